@@ -0,0 +1,80 @@
+"""Check that importing the db and util packages stays fast and side-effect free.
+
+Imports each module in a fresh interpreter, takes the median over a few runs
+and fails if it exceeds its budget or loads one of the heavy dependencies
+that are only needed once a pipeline stage runs.
+
+    python benchmarks/import_time.py --runs 5
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parents[1]
+# Module -> seconds its import may take, measured inside the interpreter
+IMPORT_BUDGETS = {
+    "db.database": 1.0,
+    "db.keyword_extraction": 1.0,
+    "db.pipeline": 1.0,
+    "util.blueprint": 0.5,
+}
+# Modules that must not be loaded by importing the budgeted ones
+HEAVY_MODULES = (
+    "pandas",
+    "numpy",
+    "nltk",
+    "yake",
+    "sklearn",
+    "scipy",
+    "langid",
+    "deepdiff",
+)
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+__import__({module!r})
+elapsed = time.perf_counter() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+"""
+
+
+def measure(module):
+    code = PROBE.format(module=module, heavy=HEAVY_MODULES)
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Imports per module")
+    args = parser.parse_args()
+
+    failures = []
+    for module, budget in IMPORT_BUDGETS.items():
+        results = [measure(module) for _ in range(args.runs)]
+        seconds = statistics.median(result["seconds"] for result in results)
+        heavy = sorted(set().union(*(result["heavy"] for result in results)))
+        print(f"{module:22} {seconds:8.3f} s (budget {budget:.3f} s)")
+        if seconds > budget:
+            failures.append(f"{module} took {seconds:.3f} s, budget {budget:.3f} s")
+        if heavy:
+            failures.append(f"{module} imports {', '.join(heavy)}")
+    if failures:
+        sys.exit("\n".join(failures))
+    print("All imports within budget")
+
+
+if __name__ == "__main__":
+    main()
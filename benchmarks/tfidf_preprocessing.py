@@ -0,0 +1,94 @@
+"""Compare TfidfPreprocessor against the original per-call tfidf_preprocessing.
+
+Runs both over the topics corpus (titles and post HTML) and checks that they
+produce identical output.
+
+    python benchmarks/tfidf_preprocessing.py --database home_assistant_blueprints.sqlite
+"""
+
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+
+from nltk.corpus import stopwords
+from nltk.stem import WordNetLemmatizer
+
+sys.path.append(str(Path(__file__).parents[1]))
+from db.database import Database
+from util.text_manipulation import TfidfPreprocessor, remove_html
+
+
+def legacy_tfidf_preprocessing(text, ignorable_words=None):
+    """tfidf_preprocessing as it was before TfidfPreprocessor."""
+    if ignorable_words is None:
+        ignorable_words = []
+    elif not isinstance(ignorable_words, list):
+        ignorable_words = [ignorable_words]
+    ignorable_words = ignorable_words + ["blueprint", "automation", "entity", "work"]
+    text = remove_html(text)
+    lemmatizer = WordNetLemmatizer()
+    ignorable_words = [lemmatizer.lemmatize(w.lower()) for w in ignorable_words]
+    text = text.lower()
+    text = re.sub(r"’", r"'", text)
+    text = re.sub(r"[^\w'\s]", "", text)
+    text = re.sub(r"\b\d+\b", "", text)
+    text = text.split()
+    text = [
+        lemmatizer.lemmatize(word)
+        for word in text
+        if word not in stopwords.words("english")
+    ]
+    text = " ".join(text)
+    safe_tokens = [re.escape(w) for w in ignorable_words if w]
+    if safe_tokens:
+        pattern = "|".join(safe_tokens)
+        text = re.sub(pattern, "", text, flags=re.IGNORECASE)
+    return text
+
+
+def load_corpus(db: Database, limit: int | None):
+    """Return (texts, tags) per topic."""
+    posts_by_topic = {}
+    for post in db.get_posts():
+        posts_by_topic.setdefault(post.topic_id, []).append(post.cooked or "")
+    corpus = []
+    for topic in db.get_topics()[:limit]:
+        texts = [topic.title or ""] + posts_by_topic.get(topic.topic_id, [])
+        corpus.append((texts, topic.tags))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default="home_assistant_blueprints.sqlite")
+    parser.add_argument("--limit", type=int, default=None, help="Number of topics")
+    args = parser.parse_args()
+
+    corpus = load_corpus(Database(database_name=args.database), args.limit)
+    n_texts = sum(len(texts) for texts, _ in corpus)
+    print(f"{len(corpus)} topics, {n_texts} texts")
+
+    start = time.perf_counter()
+    legacy = [
+        [legacy_tfidf_preprocessing(text, tags) for text in texts]
+        for texts, tags in corpus
+    ]
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    preprocessor = TfidfPreprocessor()
+    current = [preprocessor.transform(texts, tags) for texts, tags in corpus]
+    current_time = time.perf_counter() - start
+
+    print(f"legacy:            {legacy_time:8.3f} s")
+    print(f"TfidfPreprocessor: {current_time:8.3f} s")
+    print(f"speedup:           {legacy_time / current_time:8.1f}x")
+    if legacy != current:
+        sys.exit("Outputs differ")
+    print("Outputs are identical")
+
+
+if __name__ == "__main__":
+    main()
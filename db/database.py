@@ -1,19 +1,44 @@
 from collections import defaultdict
+from datetime import datetime
+import json
+import operator
 import sys
 from pathlib import Path
 from logging import debug, info, error
 from dotenv import load_dotenv
 import os
-import numpy as np
-from sqlalchemy import cast, Integer, text, func, select
+from sqlalchemy import (
+    JSON,
+    text,
+    func,
+    select,
+    insert,
+    update,
+    delete,
+    inspect,
+    and_,
+    or_,
+)
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateColumn
 from tqdm import tqdm
-import sqlite3
-import pandas as pd
 
 # Add the parent directory to the path to import modules
 sys.path.append(str(Path(__file__).parents[1]))
-from db.models import Base, Topic, Post, Blueprint, BlueprintFTS, init_database
+from db.models import (
+    Base,
+    Topic,
+    Post,
+    Blueprint,
+    BlueprintFiltered,
+    BlueprintFTS,
+    BlueprintKeyword,
+    PipelineStage,
+    create_model_tables,
+    init_database,
+)
+from util.metrics import instrument_engine, measure, timed
 
 DATABASE_NAME = "home_assistant_blueprints.sqlite"
 SCHEMA_FILE = "db/schema.sql"
@@ -22,6 +47,28 @@ POSTS_TABLE = "posts"
 BLUEPRINTS_FTS_TABLE = "blueprints_fts"
 POSTGRESQL_HOST_NAME = "imap.new.foldr.org"
 POSTGRESQL_DB_NAME = "ha_crawler"
+# Rows per upsert chunk. Rows are bound one at a time by executemany, so this
+# only bounds the IN (...) list of the existence check and the rows written
+# per statement.
+UPSERT_CHUNK_SIZE = 500
+# Rows per executemany UPDATE, committed separately
+WRITE_CHUNK_SIZE = 1000
+FTS_SEARCH_LIMIT = 20
+KEYWORD_SEARCH_LIMIT = 20
+KEYWORD_DIRECTIONS = ("input", "output")
+KEYWORD_OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "<=": operator.le,
+    "<": operator.lt,
+}
+KEYWORD_COLUMNS = (
+    "extracted_keywords",
+    "topic_keywords",
+    "keywords_yake",
+    "keywords_tfidf",
+)
 
 load_dotenv()
 
@@ -51,6 +98,7 @@ class Database:
         self.local = local
         self.engine = self.init_db(blueprints_fts_table, drop_existing_tables)
         self.create_tables()
+        self.migrate_schema()
 
     def init_db(self, blueprints_fts_table, drop_existing_tables):
         try:
@@ -60,6 +108,7 @@ class Database:
             engine = init_database(
                 database_url, self.local, blueprints_fts_table, drop_existing_tables
             )
+            instrument_engine(engine)
             info("Database setup successfully.")
             return engine
         except Exception as e:
@@ -68,12 +117,44 @@ class Database:
 
     def create_tables(self):
         try:
-            Base.metadata.create_all(self.engine)
+            create_model_tables(self.engine, self.local)
             info("Tables created successfully.")
         except Exception as e:
             error(f"Error creating tables: {e}")
             raise e
 
+    def migrate_schema(self):
+        """Add columns and indexes declared on the models that are missing in existing tables."""
+        with self.engine.begin() as connection:
+            inspector = inspect(connection)
+            for table in Base.metadata.sorted_tables:
+                # The local FTS table is an FTS5 virtual table, not the model
+                if self.local and table.name == BlueprintFTS.__tablename__:
+                    continue
+                if not inspector.has_table(table.name):
+                    continue
+                existing = {col["name"] for col in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    column_ddl = CreateColumn(column).compile(
+                        dialect=self.engine.dialect
+                    )
+                    connection.execute(
+                        text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}")
+                    )
+                    info(f"Added column {table.name}.{column.name}")
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
+
+    def has_legacy_filtered_table(self) -> bool:
+        """Whether blueprints_filtered was written by to_sql, without a primary key."""
+        table_name = BlueprintFiltered.__tablename__
+        inspector = inspect(self.engine)
+        if not inspector.has_table(table_name):
+            return False
+        return not inspector.get_pk_constraint(table_name)["constrained_columns"]
+
     def open_session(self):
         Session = sessionmaker(bind=self.engine)
         return Session()
@@ -143,12 +224,10 @@ class Database:
             setattr(blueprint, key, value)
         return blueprint_id
 
-    def _check_blueprint_url_exists(self, blueprint_url):
-        session = self.open_session()
+    def _check_blueprint_url_exists(self, session, blueprint_url):
         blueprint = (
             session.query(Blueprint).filter_by(blueprint_url=blueprint_url).first()
         )
-        session.close()
         return bool(blueprint)
 
     def check_blueprint_hash_exists(self, blueprint_hash, session):
@@ -159,7 +238,7 @@ class Database:
 
     def upsert_blueprint(self, session, blueprint_url, force_insert=False, **kwargs):
         debug(f"Upserting blueprint: {blueprint_url}")
-        if force_insert or not self._check_blueprint_url_exists(blueprint_url):
+        if force_insert or not self._check_blueprint_url_exists(session, blueprint_url):
             blueprint_id = self._insert_blueprint(session, blueprint_url, **kwargs)
             debug(f"Blueprint inserted: {blueprint_url}")
         else:
@@ -167,6 +246,122 @@ class Database:
             debug(f"Blueprint updated: {blueprint_url}")
         return blueprint_id
 
+    def _insert_statement(self, model):
+        dialect = sqlite if self.local else postgresql
+        return dialect.insert(model)
+
+    @timed("db.bulk_upsert", rows=lambda counts: sum(counts.values()))
+    def _bulk_upsert(self, session, model, key, rows, chunk_size):
+        """Upsert rows matched on the unique column ``key``, chunk by chunk."""
+        key_column = getattr(model, key)
+        counts = {"inserted": 0, "updated": 0}
+        rows = list(rows)
+        missing = sum(1 for row in rows if row.get(key) is None)
+        if missing:
+            raise ValueError(f"Invalid rows: {missing} without a {key}")
+        for start in range(0, len(rows), chunk_size):
+            # Postgres rejects a statement that touches the same row twice,
+            # so keep the last occurrence of each key within the chunk.
+            chunk = {row[key]: row for row in rows[start : start + chunk_size]}
+            existing = set(
+                session.execute(
+                    select(key_column).where(key_column.in_(list(chunk)))
+                ).scalars()
+            )
+            # executemany needs a uniform set of columns per statement
+            by_columns = defaultdict(list)
+            for row in chunk.values():
+                by_columns[tuple(sorted(row))].append(row)
+            for columns, group in by_columns.items():
+                stmt = self._insert_statement(model)
+                update_columns = {
+                    column: stmt.excluded[column]
+                    for column in columns
+                    if column not in (key, "id")
+                }
+                if update_columns:
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[key], set_=update_columns
+                    )
+                else:
+                    stmt = stmt.on_conflict_do_nothing(index_elements=[key])
+                session.execute(stmt, group)
+            updated = len(existing)
+            counts["updated"] += updated
+            counts["inserted"] += len(chunk) - updated
+            debug(
+                f"Upserted {len(chunk)} rows into {model.__tablename__}: "
+                f"{len(chunk) - updated} inserted, {updated} updated"
+            )
+        return counts
+
+    @timed("db.bulk_upsert", rows=lambda counts: sum(counts.values()))
+    def _bulk_upsert_by_lookup(self, session, model, key, rows, chunk_size):
+        """Upsert rows matched on a non-unique column, updating its first row."""
+        key_column = getattr(model, key)
+        counts = {"inserted": 0, "updated": 0}
+        rows = list(rows)
+        missing = sum(1 for row in rows if row.get(key) is None)
+        if missing:
+            raise ValueError(f"Invalid rows: {missing} without a {key}")
+        for start in range(0, len(rows), chunk_size):
+            chunk = {row[key]: row for row in rows[start : start + chunk_size]}
+            existing = dict(
+                session.execute(
+                    select(key_column, func.min(model.id))
+                    .where(key_column.in_(list(chunk)))
+                    .group_by(key_column)
+                ).all()
+            )
+            inserts = [row for value, row in chunk.items() if value not in existing]
+            updates = [
+                {**row, "id": existing[value]}
+                for value, row in chunk.items()
+                if value in existing
+            ]
+            if inserts:
+                session.execute(insert(model), inserts)
+            if updates:
+                session.execute(update(model), updates)
+            counts["inserted"] += len(inserts)
+            counts["updated"] += len(updates)
+        return counts
+
+    def _run_bulk_upsert(self, model, key, rows, chunk_size, session, upsert=None):
+        upsert = upsert or self._bulk_upsert
+        if session is not None:
+            return upsert(session, model, key, rows, chunk_size)
+        session = self.open_session()
+        try:
+            counts = upsert(session, model, key, rows, chunk_size)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        info(f"Upserted {model.__tablename__}: {counts}")
+        return counts
+
+    def upsert_topics(self, rows, chunk_size=UPSERT_CHUNK_SIZE, session=None):
+        """Insert or update topics keyed on ``topic_id``, returning the counts."""
+        return self._run_bulk_upsert(Topic, "topic_id", rows, chunk_size, session)
+
+    def upsert_posts(self, rows, chunk_size=UPSERT_CHUNK_SIZE, session=None):
+        """Insert or update posts keyed on ``post_id``, returning the counts."""
+        return self._run_bulk_upsert(Post, "post_id", rows, chunk_size, session)
+
+    def upsert_blueprints(self, rows, chunk_size=UPSERT_CHUNK_SIZE, session=None):
+        """Insert or update blueprints keyed on ``blueprint_url``, returning the counts."""
+        return self._run_bulk_upsert(
+            Blueprint,
+            "blueprint_url",
+            rows,
+            chunk_size,
+            session,
+            upsert=self._bulk_upsert_by_lookup,
+        )
+
     def _insert_blueprint_fts(self, session, blueprint_id, **kwargs):
         if self.local:
             self._insert_blueprint_fts_sqlite(session, blueprint_id, **kwargs)
@@ -239,32 +434,129 @@ class Database:
             self._update_blueprint_fts(session, blueprint_id, **kwargs)
             debug(f"Blueprint updated on FTS table: {blueprint_id}")
 
-    def get_all_blueprints(self):
+    @timed("db.replace_blueprint_fts", rows=lambda count: count)
+    def replace_blueprint_fts(self, rows, chunk_size=UPSERT_CHUNK_SIZE):
+        """Replace the contents of the FTS table with ``rows`` in one transaction."""
+        rows = list(rows)
         session = self.open_session()
-        blueprints = session.query(Blueprint).all()
-        for blueprint in tqdm(blueprints, desc="Loading blueprints"):
-            blueprint.topic_title = blueprint.post.topic.title
-            blueprint.topic_id = blueprint.post.topic.topic_id
-            blueprint.tags = blueprint.post.topic.tags
-            blueprint.created_at = blueprint.post.created_at
-            blueprint.post_content = blueprint.post.cooked
+        try:
+            if self.local:
+                session.execute(text(f"DELETE FROM {self.blueprints_fts_table}"))
+            else:
+                session.execute(delete(BlueprintFTS))
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start : start + chunk_size]
+                if self.local:
+                    columns = list(chunk[0])
+                    session.execute(
+                        text(
+                            f"INSERT INTO {self.blueprints_fts_table} "
+                            f"({', '.join(columns)}) "
+                            f"VALUES ({', '.join(f':{column}' for column in columns)})"
+                        ),
+                        chunk,
+                    )
+                else:
+                    session.execute(insert(BlueprintFTS), chunk)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        info(f"Rebuilt {self.blueprints_fts_table} with {len(rows)} blueprints")
+        return len(rows)
 
-        session.close()
-        return blueprints
+    def _blueprint_frame(self, stmt, output):
+        import pandas as pd
 
-    def get_blueprints_by_ids(self, blueprint_ids):
-        session = self.open_session()
-        blueprints = (
-            session.query(Blueprint).filter(Blueprint.id.in_(blueprint_ids)).all()
+        with self.engine.connect() as conn:
+            result = conn.execute(stmt)
+            columns = list(result.keys())
+            rows = result.all()
+        if output == "pandas":
+            return pd.DataFrame(rows, columns=columns)
+        if output == "arrow":
+            import pyarrow as pa
+
+            # Keyword dicts have free-form keys, store them as JSON strings
+            # instead of letting Arrow infer a struct type per column.
+            json_columns = {
+                column.name
+                for column in Blueprint.__table__.columns
+                if isinstance(column.type, JSON)
+            }
+            return pa.table(
+                {
+                    name: [
+                        (
+                            json.dumps(row[i])
+                            if name in json_columns and row[i] is not None
+                            else row[i]
+                        )
+                        for row in rows
+                    ]
+                    for i, name in enumerate(columns)
+                }
+            )
+        raise ValueError(f"Invalid output format: {output}")
+
+    @timed("db.load_blueprints", rows=len)
+    def _load_blueprints(
+        self, extra_columns, where=None, output=None, limit=None, offset=None
+    ):
+        """Load blueprints with projected post and topic columns in one SELECT."""
+        projected = [column.label(name) for name, column in extra_columns.items()]
+        if output is not None:
+            stmt = select(*Blueprint.__table__.columns, *projected)
+        else:
+            stmt = select(Blueprint, *projected)
+        stmt = stmt.outerjoin(Post, Blueprint.post_id == Post.post_id).outerjoin(
+            Topic, Post.topic_id == Topic.topic_id
         )
-        for blueprint in tqdm(blueprints, desc="Loading blueprints"):
-            blueprint.topic_title = blueprint.post.topic.title
-            blueprint.created_at = blueprint.post.created_at
-            blueprint.post_url = blueprint.post.post_url
+        if where is not None:
+            stmt = stmt.where(where)
+        if limit is not None or offset is not None:
+            stmt = stmt.order_by(Blueprint.id).limit(limit).offset(offset)
 
+        if output is not None:
+            return self._blueprint_frame(stmt, output)
+
+        session = self.open_session()
+        blueprints = []
+        for blueprint, *values in tqdm(
+            session.execute(stmt), desc="Loading blueprints"
+        ):
+            for name, value in zip(extra_columns, values):
+                setattr(blueprint, name, value)
+            blueprints.append(blueprint)
         session.close()
         return blueprints
 
+    def get_all_blueprints(self, output=None, lang=None):
+        return self._load_blueprints(
+            {
+                "topic_title": Topic.title,
+                "topic_id": Topic.topic_id,
+                "tags": Topic.tags,
+                "created_at": Post.created_at,
+                "post_content": Post.cooked,
+            },
+            where=Blueprint.lang == lang if lang else None,
+            output=output,
+        )
+
+    def get_blueprints_by_ids(self, blueprint_ids, output=None):
+        return self._load_blueprints(
+            {
+                "topic_title": Topic.title,
+                "created_at": Post.created_at,
+                "post_url": Post.post_url,
+            },
+            where=Blueprint.id.in_(blueprint_ids),
+            output=output,
+        )
+
     def get_topics(self):
         session = self.open_session()
         topics = session.query(Topic).all()
@@ -277,11 +569,138 @@ class Database:
         session.close()
         return posts
 
+    @timed("db.get_stale_blueprints", rows=len)
+    def get_stale_blueprints(self, source_hash_column, *conditions, full=False):
+        """Return id, code and hash of blueprints whose derived data is out of date."""
+        import pandas as pd
+
+        source_hash = getattr(Blueprint, source_hash_column)
+        stmt = select(Blueprint.id, Blueprint.blueprint_code, Blueprint.blueprint_hash)
+        if not full:
+            stmt = stmt.where(
+                or_(
+                    source_hash.is_(None),
+                    source_hash != Blueprint.blueprint_hash,
+                    *conditions,
+                )
+            )
+        with self.engine.connect() as conn:
+            return pd.read_sql(stmt, conn)
+
+    def get_blueprints_for_keyword_extraction(self, extractor_version, full=False):
+        """Return blueprints whose keywords are new, changed or from another extractor version."""
+        return self.get_stale_blueprints(
+            "keywords_source_hash",
+            Blueprint.keywords_extractor_version.is_(None),
+            Blueprint.keywords_extractor_version != extractor_version,
+            full=full,
+        )
+
     def update_blueprint_keywords(self, blueprint_id, keywords, session):
         blueprint = session.query(Blueprint).filter_by(id=blueprint_id).first()
         blueprint.extracted_keywords = keywords
+        self._sync_keyword_index(session, [blueprint.id], {blueprint.id: keywords})
         debug(f"Blueprint keywords updated: {blueprint_id}")
 
+    def _keyword_index_rows(self, blueprint_id, keywords):
+        rows = []
+        for key, count in (keywords or {}).items():
+            direction, _, keyword = key.partition("__")
+            if direction not in KEYWORD_DIRECTIONS or not keyword:
+                continue
+            rows.append(
+                {
+                    "blueprint_id": blueprint_id,
+                    "direction": direction,
+                    "keyword": keyword,
+                    "count": count,
+                }
+            )
+        return rows
+
+    def _sync_keyword_index(self, session, blueprint_ids, keywords_by_id):
+        """Replace the blueprint_keyword rows of the given blueprints."""
+        session.execute(
+            delete(BlueprintKeyword).where(
+                BlueprintKeyword.blueprint_id.in_(blueprint_ids)
+            )
+        )
+        rows = [
+            row
+            for blueprint_id, keywords in keywords_by_id.items()
+            for row in self._keyword_index_rows(blueprint_id, keywords)
+        ]
+        if rows:
+            session.execute(BlueprintKeyword.__table__.insert(), rows)
+
+    def rebuild_keyword_index(self, chunk_size=WRITE_CHUNK_SIZE):
+        """Refill blueprint_keyword from the stored extracted_keywords."""
+        stmt = select(Blueprint.id, Blueprint.extracted_keywords).where(
+            Blueprint.extracted_keywords.is_not(None)
+        )
+        session = self.open_session()
+        try:
+            session.execute(delete(BlueprintKeyword))
+            rows = session.execute(stmt).all()
+            for start in range(0, len(rows), chunk_size):
+                chunk = dict(rows[start : start + chunk_size])
+                self._sync_keyword_index(session, list(chunk), chunk)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        info(f"Rebuilt the keyword index of {len(rows)} blueprints")
+
+    def ensure_keyword_index(self):
+        """Build blueprint_keyword if it is empty while keywords exist."""
+        with self.engine.connect() as conn:
+            indexed = conn.execute(select(BlueprintKeyword.blueprint_id).limit(1))
+            if indexed.first() is not None:
+                return
+            extracted = conn.execute(
+                select(Blueprint.id)
+                .where(Blueprint.extracted_keywords.is_not(None))
+                .limit(1)
+            )
+            if extracted.first() is None:
+                return
+        self.rebuild_keyword_index()
+
+    def _keyword_predicate(self, direction, keyword, op, count):
+        if direction not in KEYWORD_DIRECTIONS:
+            raise ValueError(f"Invalid keyword direction: {direction}")
+        if op not in KEYWORD_OPERATORS:
+            raise ValueError("Invalid operator")
+        matching = select(BlueprintKeyword.blueprint_id).where(
+            BlueprintKeyword.direction == direction,
+            BlueprintKeyword.keyword == keyword,
+            KEYWORD_OPERATORS[op](BlueprintKeyword.count, count),
+        )
+        return Blueprint.id.in_(matching)
+
+    @timed("db.search_keywords", rows=len)
+    def search_blueprints_by_keyword_predicates(
+        self, predicates, match="all", limit=KEYWORD_SEARCH_LIMIT, offset=0
+    ):
+        """Return blueprints matching ``(direction, keyword, op, count)`` predicates."""
+        conditions = [self._keyword_predicate(*predicate) for predicate in predicates]
+        if match == "all":
+            where = and_(*conditions) if conditions else None
+        elif match == "any":
+            where = or_(*conditions) if conditions else None
+        else:
+            raise ValueError(f"Invalid match: {match}")
+        # Index keywords stored before blueprint_keyword existed
+        self.ensure_keyword_index()
+        return self._load_blueprints(
+            {"topic_title": Topic.title, "topic_tags": Topic.tags},
+            where=where,
+            limit=limit,
+            offset=offset,
+        )
+
     def search_blueprint_by_keywords(
         self,
         input_keyword: str,
@@ -290,149 +709,104 @@ class Database:
         output_keyword: str,
         output_operator: str,
         output_count: int,
+        limit: int = KEYWORD_SEARCH_LIMIT,
+        offset: int = 0,
     ):
-        # Create search conditions
-        search_conditions = []
+        predicates = []
         if input_keyword != "":
-            input_query_target = cast(
-                text(f"extracted_keywords->>'input__{input_keyword}'"),
-                Integer,
-            )
-            if input_operator == ">":
-                input_query = input_query_target > input_count
-            elif input_operator == "==":
-                input_query = input_query_target == input_count
-            elif input_operator == "<":
-                input_query = input_query_target < input_count
-            else:
-                raise ValueError("Invalid operator")
-            search_conditions.append(input_query)
+            predicates.append(("input", input_keyword, input_operator, input_count))
         if output_keyword != "":
-            output_query_target = cast(
-                text(f"extracted_keywords->>'output__{output_keyword}'"),
-                Integer,
-            )
-            if output_operator == ">":
-                output_query = output_query_target > output_count
-            elif output_operator == "==":
-                output_query = output_query_target == output_count
-            elif output_operator == "<":
-                output_query = output_query_target < output_count
-            else:
-                raise ValueError("Invalid operator")
-            search_conditions.append(output_query)
+            predicates.append(("output", output_keyword, output_operator, output_count))
+        return self.search_blueprints_by_keyword_predicates(
+            predicates, limit=limit, offset=offset
+        )
 
-        # Run query
-        session = self.open_session()
-        query = (
-            session.query(Blueprint)
-            .filter(
-                *search_conditions,
-            )
-            .limit(20)
+    def _fts_frame(self, rows):
+        import pandas as pd
+
+        return pd.DataFrame(
+            [tuple(row) for row in rows],
+            columns=["blueprint_id", "topic_title", "blueprint_code", "rank"],
         )
-        result = query.all()
-        for bp in result:
-            bp.topic_title = bp.post.topic.title
-            bp.topic_tags = bp.post.topic.tags
-        session.close()
-        return result
 
-    def search_blueprint_by_fts_on_blueprint_code(self, query_string: str):
+    @timed("db.search_fts", rows=len)
+    def _search_fts_sqlite(self, conditions, params, limit):
+        # FTS5 ranks by bm25, where lower values are better matches
+        query = text(f"""
+            SELECT blueprint_id, topic_title, blueprint_code, rank
+            FROM {self.blueprints_fts_table}
+            WHERE {" OR ".join(conditions)}
+            ORDER BY rank
+            LIMIT :limit
+            """)
+        with self.engine.connect() as conn:
+            rows = conn.execute(query, {**params, "limit": limit}).all()
+        return self._fts_frame(rows)
+
+    @timed("db.search_fts", rows=len)
+    def _search_fts_postgresql(self, operations, rank, limit, min_rank=None):
+        stmt = select(
+            BlueprintFTS.blueprint_id,
+            BlueprintFTS.topic_title,
+            BlueprintFTS.blueprint_code,
+            rank,
+        ).where(*operations)
+        if min_rank is not None:
+            stmt = stmt.where(rank >= min_rank)
+        stmt = stmt.order_by(rank.desc()).limit(limit)
+        with self.engine.connect() as conn:
+            rows = conn.execute(stmt).all()
+        return self._fts_frame(rows)
+
+    def search_blueprint_by_fts_on_blueprint_code(
+        self, query_string: str, limit: int = FTS_SEARCH_LIMIT
+    ):
         if self.local:
-            conn = sqlite3.connect("home_assistant_blueprints.sqlite")
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT blueprint_id, topic_title, blueprint_code, rank FROM blueprints_fts WHERE blueprint_expanded MATCH ? ORDER BY rank DESC LIMIT 20",
-                (query_string,),
-            )
-            blueprints = cursor.fetchall()
-            conn.close()
-            result = pd.DataFrame(
-                blueprints,
-                columns=["blueprint_id", "topic_title", "blueprint_code", "rank"],
+            return self._search_fts_sqlite(
+                ["blueprint_expanded MATCH :query"], {"query": query_string}, limit
             )
-            return result
 
-        else:
-            session = self.open_session()
-            tsquery = func.plainto_tsquery("english", query_string)
-            tsvector = func.to_tsvector("english", BlueprintFTS.blueprint_expanded)
-            rank = func.ts_rank(tsvector, tsquery).label("rank")
-            query = (
-                session.query(BlueprintFTS, rank)
-                .filter(tsvector.op("@@")(tsquery))
-                .order_by(rank.desc())
-            ).limit(20)
-            blueprints = query.all()
-            data = []
-            for bp, rank in blueprints:
-                if rank < 0.001:
-                    continue
-                bp_dict = {
-                    "blueprint_id": bp.blueprint_id,
-                    "topic_title": bp.topic_title,
-                    "blueprint_code": bp.blueprint_code,
-                    "rank": rank,
-                }
-                data.append(bp_dict)
-            result = pd.DataFrame(data)
-            session.close()
-            return result
+        tsquery = func.plainto_tsquery("english", query_string)
+        tsvector = BlueprintFTS.blueprint_expanded_tsv
+        rank = func.ts_rank(tsvector, tsquery).label("rank")
+        return self._search_fts_postgresql(
+            [tsvector.op("@@")(tsquery)], rank, limit, min_rank=0.001
+        )
 
     def search_blueprint_by_fts_on_blueprint_sections(
-        self, query_input: str, query_output: str
+        self, query_input: str, query_output: str, limit: int = FTS_SEARCH_LIMIT
     ):
-        if self.local:
-            conn = sqlite3.connect("home_assistant_blueprints.sqlite")
-            cursor = conn.cursor()
+        if not query_input and not query_output:
+            return self._fts_frame([])
 
-            query_parts = []
-            query_params = []
+        if self.local:
+            conditions = []
+            params = {}
             if query_input:
-                query_parts.append("blueprint_input MATCH ?")
-                query_params.append(query_input)
+                conditions.append("blueprint_input MATCH :query_input")
+                params["query_input"] = query_input
             if query_output:
-                query_parts.append("blueprint_action MATCH ?")
-                query_params.append(query_output)
-            query_string = " OR ".join(query_parts)
-            query_full = f"SELECT blueprint_id, topic_title, blueprint_code, rank FROM blueprints_fts WHERE {query_string} ORDER BY rank DESC LIMIT 20"
-
-            cursor.execute(query_full, query_params)
-            blueprints = cursor.fetchall()
-            conn.close()
-            result = pd.DataFrame(
-                blueprints,
-                columns=["blueprint_id", "topic_title", "blueprint_code", "rank"],
-            )
-            return result
-        else:
-            session = self.open_session()
-            # tsquery
-            tsquery_input = func.plainto_tsquery("english", query_input)
-            tsquery_output = func.plainto_tsquery("english", query_output)
-            # tsvector
-            tsvector_input = func.to_tsvector("english", BlueprintFTS.blueprint_input)
-            tsvector_output = func.to_tsvector("english", BlueprintFTS.blueprint_action)
-            # rank
-            rank_input = func.ts_rank(tsvector_input, tsquery_input)
-            rank_output = func.ts_rank(tsvector_output, tsquery_output)
-            combined_rank = (rank_input + rank_output).label("rank")
-            # query
-            operations = []
-            if query_input != "":
-                operations.append(tsvector_input.op("@@")(tsquery_input))
-            if query_output != "":
-                operations.append(tsvector_output.op("@@")(tsquery_output))
-            query = (
-                session.query(BlueprintFTS, combined_rank)
-                .filter(
-                    *operations,
-                )
-                .order_by(combined_rank.desc())
-            ).limit(20)
+                conditions.append("blueprint_action MATCH :query_output")
+                params["query_output"] = query_output
+            return self._search_fts_sqlite(conditions, params, limit)
 
-            blueprints = query.all()
+        # tsquery
+        tsquery_input = func.plainto_tsquery("english", query_input)
+        tsquery_output = func.plainto_tsquery("english", query_output)
+        # tsvector
+        tsvector_input = BlueprintFTS.blueprint_input_tsv
+        tsvector_output = BlueprintFTS.blueprint_action_tsv
+        # rank
+        rank_input = func.ts_rank(tsvector_input, tsquery_input)
+        rank_output = func.ts_rank(tsvector_output, tsquery_output)
+        combined_rank = (rank_input + rank_output).label("rank")
+        # query
+        operations = []
+        if query_input:
+            operations.append(tsvector_input.op("@@")(tsquery_input))
+        if query_output:
+            operations.append(tsvector_output.op("@@")(tsquery_output))
+        return self._search_fts_postgresql(operations, combined_rank, limit)
 
     def get_posts_by_topic_id(self, topic_id):
         session = self.open_session()
@@ -501,12 +875,154 @@ class Database:
         blueprint.keywords_tfidf = keywords
         debug(f"Blueprint TF-IDF topic keywords updated: {blueprint_id}")
 
-    def update_blueprint_filtered_table(self, bp_df: pd.DataFrame):
+    def _bulk_update(self, model, mappings, chunk_size, before_commit=None):
+        with measure(f"db.update.{model.__tablename__}", rows=len(mappings)):
+            session = self.open_session()
+            try:
+                for start in range(0, len(mappings), chunk_size):
+                    chunk = mappings[start : start + chunk_size]
+                    session.execute(update(model), chunk)
+                    if before_commit is not None:
+                        before_commit(session, chunk)
+                    session.commit()
+                    debug(f"Updated {len(chunk)} rows of {model.__tablename__}")
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+    def update_blueprints(self, mappings, chunk_size=WRITE_CHUNK_SIZE):
+        """Bulk update blueprints from dicts holding ``id`` and the new values."""
+
+        def sync_keyword_index(session, chunk):
+            keywords_by_id = {
+                row["id"]: row["extracted_keywords"]
+                for row in chunk
+                if "extracted_keywords" in row
+            }
+            if keywords_by_id:
+                self._sync_keyword_index(session, list(keywords_by_id), keywords_by_id)
+
+        self._bulk_update(Blueprint, mappings, chunk_size, sync_keyword_index)
+
+    def update_filtered_blueprints(self, mappings, chunk_size=WRITE_CHUNK_SIZE):
+        """Bulk update blueprints_filtered rows like update_blueprints."""
+        now = datetime.now()
+        mappings = [{"updated_at": now, **mapping} for mapping in mappings]
+        self._bulk_update(BlueprintFiltered, mappings, chunk_size)
+
+    def write_keywords(
+        self, column, values, chunk_size=WRITE_CHUNK_SIZE, extra_columns=None
+    ):
+        """Bulk update a keyword column from a ``{blueprint_id: value}`` mapping."""
+        if column not in KEYWORD_COLUMNS:
+            raise ValueError(f"Invalid keyword column: {column}")
+        mappings = [
+            {
+                # ids may come from pandas as numpy integers
+                "id": int(blueprint_id),
+                column: value,
+                **(extra_columns or {}).get(blueprint_id, {}),
+            }
+            for blueprint_id, value in values.items()
+        ]
+        self.update_blueprints(mappings, chunk_size)
+        info(f"Updated {column} of {len(mappings)} blueprints")
+
+    def get_blueprint_ids_by_language(self, lang="en"):
+        stmt = select(Blueprint.id).where(Blueprint.lang == lang)
+        with self.engine.connect() as conn:
+            return conn.execute(stmt).scalars().all()
+
+    def get_minhash_signatures(self):
+        """Return ``(id, signature bytes)`` of all blueprints with a signature."""
+        stmt = select(Blueprint.id, Blueprint.minhash_signature).where(
+            Blueprint.minhash_signature.is_not(None)
+        )
         with self.engine.connect() as conn:
-            bp_df.to_sql("blueprints_filtered", conn, if_exists="replace", index=False)
+            return conn.execute(stmt).all()
+
+    def get_filtered_blueprint_rows(self):
+        """Return the stored blueprints_filtered rows without their update time."""
+        import pandas as pd
+
+        columns = [
+            column
+            for column in BlueprintFiltered.__table__.columns
+            if column.name != "updated_at"
+        ]
+        with self.engine.connect() as conn:
+            return pd.read_sql(select(*columns), conn)
+
+    @timed("db.sync_filtered_blueprints", rows=lambda counts: sum(counts.values()))
+    def sync_filtered_blueprints(
+        self, rows, deleted_ids, chunk_size=UPSERT_CHUNK_SIZE, rebuild=False
+    ):
+        """Upsert and delete blueprints_filtered rows in one transaction."""
+        deleted_ids = [int(bp_id) for bp_id in deleted_ids]
+        session = self.open_session()
+        try:
+            if rebuild:
+                # The DELETE opens the transaction, SQLite's driver doesn't
+                # for DDL statements
+                session.execute(delete(BlueprintFiltered))
+                connection = session.connection()
+                BlueprintFiltered.__table__.drop(connection)
+                BlueprintFiltered.__table__.create(connection)
+                info(f"Recreated {BlueprintFiltered.__tablename__} with a primary key")
+            counts = self._bulk_upsert(
+                session, BlueprintFiltered, "id", rows, chunk_size
+            )
+            for start in range(0, len(deleted_ids), chunk_size):
+                chunk = deleted_ids[start : start + chunk_size]
+                session.execute(
+                    delete(BlueprintFiltered).where(BlueprintFiltered.id.in_(chunk))
+                )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        counts["deleted"] = len(deleted_ids)
+        info(f"Synced blueprints_filtered: {counts}")
+        return counts
 
     def get_filtered_bps(self):
+        import pandas as pd
+
         with self.engine.connect() as conn:
             bp_df = pd.read_sql_table("blueprints_filtered", conn)
         self.engine.dispose()
         return bp_df
+
+    def get_pipeline_stages(self):
+        """Return ``{stage: (input_state, finished_at)}`` of recorded stage runs."""
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(
+                    PipelineStage.stage,
+                    PipelineStage.input_state,
+                    PipelineStage.finished_at,
+                )
+            ).all()
+        return {
+            stage: (input_state, finished_at)
+            for stage, input_state, finished_at in rows
+        }
+
+    def record_pipeline_stage(self, stage, input_state, finished_at):
+        return self._run_bulk_upsert(
+            PipelineStage,
+            "stage",
+            [
+                {
+                    "stage": stage,
+                    "input_state": input_state,
+                    "finished_at": finished_at,
+                }
+            ],
+            UPSERT_CHUNK_SIZE,
+            None,
+        )
@@ -0,0 +1,93 @@
+import sys
+from pathlib import Path
+from logging import info, error
+
+# Add the parent directory to the path to import modules
+sys.path.append(str(Path(__file__).parents[1]))
+from db.database import Database
+from util.parallel import parallel_map
+
+# Created on first use per process, util.minhash needs numpy
+_minhasher = None
+
+
+def _get_minhasher():
+    global _minhasher
+    if _minhasher is None:
+        from util.minhash import MinHasher
+
+        _minhasher = MinHasher()
+    return _minhasher
+
+
+def _signature_bytes(blueprint_code):
+    from util.minhash import signature_to_bytes
+
+    try:
+        signature = _get_minhasher().signature_from_code(blueprint_code)
+        if signature is None:
+            return None, None
+        return signature_to_bytes(signature), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def update_minhash_signatures(db: Database, full=False, workers=1):
+    """Compute MinHash signatures for new or changed blueprints."""
+    df_bp = db.get_stale_blueprints("minhash_source_hash", full=full)
+    info(f"Computing MinHash signatures for {len(df_bp)} blueprints")
+    if df_bp.empty:
+        return 0
+
+    results = parallel_map(
+        _signature_bytes,
+        df_bp["blueprint_code"],
+        workers=workers,
+        desc="Computing MinHash signatures",
+    )
+
+    mappings = []
+    for bp_id, bp_hash, (signature, err) in zip(
+        df_bp["id"], df_bp["blueprint_hash"], results
+    ):
+        if err is not None:
+            error(f"MinHash failed for blueprint {bp_id}: {err}")
+            continue
+        mappings.append(
+            {
+                "id": int(bp_id),
+                "minhash_signature": signature,
+                "minhash_source_hash": bp_hash,
+            }
+        )
+    db.update_blueprints(mappings)
+    info(f"Updated MinHash signatures of {len(mappings)} blueprints")
+    return len(mappings)
+
+
+def load_lsh_index(db: Database, index=None):
+    """Build or update a util.minhash.LSHIndex from the stored signatures."""
+    from util.minhash import LSHIndex, signature_from_bytes
+
+    if index is None:
+        index = LSHIndex()
+    stored = set()
+    for bp_id, signature in db.get_minhash_signatures():
+        stored.add(bp_id)
+        index.add(bp_id, signature_from_bytes(signature))
+    for bp_id in list(index.signatures):
+        if bp_id not in stored:
+            index.remove(bp_id)
+    return index
+
+
+def find_near_duplicates(db: Database, blueprint_id, threshold=0.8, index=None):
+    """Return ``(blueprint_id, similarity)`` of near duplicates of a blueprint."""
+    index = index or load_lsh_index(db)
+    return index.query(blueprint_id, threshold)
+
+
+def find_duplicate_clusters(db: Database, threshold=0.8, index=None):
+    """Return lists of blueprint ids whose structures are near duplicates."""
+    index = index or load_lsh_index(db)
+    return index.clusters(threshold)
@@ -0,0 +1,114 @@
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+from logging import info, warning
+
+# Add the parent directory to the path to import modules
+sys.path.append(str(Path(__file__).parents[1]))
+from db.database import Database
+from db.models import BlueprintFiltered
+from util.text_manipulation import keywords_remove_input, parse_yaml_cached
+
+FILTER_LANGUAGE = "en"
+DUPLICATE_THRESHOLD = 0.8
+JSON_COLUMNS = (
+    "extracted_keywords",
+    "topic_keywords",
+    "keywords_yake",
+    "keywords_tfidf",
+)
+
+
+def _normalized_code(blueprint_code):
+    from util.structural_diff import normalize_blueprint
+
+    try:
+        bp_dict = parse_yaml_cached(blueprint_code)
+        if bp_dict is None:
+            # Invalid YAML, which would otherwise normalize like every other one
+            return None
+        return normalize_blueprint(bp_dict)
+    except Exception as e:
+        warning(f"Could not parse blueprint for deduplication: {e}")
+        return None
+
+
+def find_topic_duplicates(bp_df, threshold=DUPLICATE_THRESHOLD):
+    """Return ids of blueprints that near-duplicate a lower id in their topic."""
+    from util.structural_diff import similar_pairs
+
+    duplicates = set()
+    for _, group in bp_df.groupby("topic_id", sort=False):
+        if len(group) < 2:
+            continue
+        group = group.sort_values("id")
+        normalized = [_normalized_code(code) for code in group["blueprint_code"]]
+        ids = [
+            bp_id for bp_id, code in zip(group["id"], normalized) if code is not None
+        ]
+        if len(ids) < 2:
+            continue
+        codes = [code for code in normalized if code is not None]
+
+        parent = list(range(len(ids)))
+
+        def find(i):
+            while parent[i] != i:
+                i = parent[i]
+            return i
+
+        for i, j, _ in similar_pairs(codes, threshold):
+            root1, root2 = find(i), find(j)
+            if root1 != root2:
+                parent[max(root1, root2)] = min(root1, root2)
+        duplicates.update(ids[i] for i in range(len(ids)) if find(i) != i)
+    return duplicates
+
+
+def _filtered_rows(bp_df):
+    """Convert loaded blueprints to the blueprints_filtered columns."""
+    bp_df = bp_df.copy()
+    for column in JSON_COLUMNS:
+        bp_df[column] = bp_df[column].apply(
+            lambda x: json.dumps(x) if x is not None else None
+        )
+    bp_df["processed_keywords"] = bp_df["extracted_keywords"].apply(
+        lambda x: json.dumps(keywords_remove_input(x)) if x is not None else None
+    )
+    columns = [
+        column.name
+        for column in BlueprintFiltered.__table__.columns
+        if column.name != "updated_at"
+    ]
+    return bp_df[columns]
+
+
+def _records(df) -> dict:
+    """Return ``{id: row dict}`` with missing values as None."""
+    df = df.astype(object).where(df.notna(), None)
+    return {int(row["id"]): row for row in df.to_dict("records")}
+
+
+def update_filtered_blueprints(
+    db: Database, lang=FILTER_LANGUAGE, threshold=DUPLICATE_THRESHOLD
+):
+    """Bring blueprints_filtered up to date with the blueprints table."""
+    candidates = db.get_all_blueprints(output="pandas", lang=lang)
+    duplicates = find_topic_duplicates(candidates, threshold)
+    info(
+        f"Filtering {len(candidates)} '{lang}' blueprints, "
+        f"dropping {len(duplicates)} near duplicates"
+    )
+    wanted = _records(_filtered_rows(candidates[~candidates["id"].isin(duplicates)]))
+    rebuild = db.has_legacy_filtered_table()
+    stored = {} if rebuild else _records(db.get_filtered_blueprint_rows())
+
+    now = datetime.now()
+    changed = [
+        {**row, "updated_at": now}
+        for bp_id, row in wanted.items()
+        if stored.get(bp_id) != row
+    ]
+    deleted = [bp_id for bp_id in stored if bp_id not in wanted]
+    return db.sync_filtered_blueprints(changed, deleted, rebuild=rebuild)
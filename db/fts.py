@@ -0,0 +1,55 @@
+import sys
+from pathlib import Path
+from logging import info, warning
+
+# Add the parent directory to the path to import modules
+sys.path.append(str(Path(__file__).parents[1]))
+from db.database import Database
+from util.blueprint import analyze_blueprint
+from util.blueprint.analyze import TEXT_FIELDS
+from util.parallel import parallel_map
+from util.text_manipulation import parse_yaml_cached
+
+
+def _text_fields(blueprint_code):
+    try:
+        return analyze_blueprint(parse_yaml_cached(blueprint_code), text=True).text
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+
+def update_blueprint_fts(db: Database, workers=1):
+    """Rebuild the full text search table from the blueprints, posts and topics."""
+    df_bp = db.get_all_blueprints(output="pandas")
+    info(f"Building the full text search index of {len(df_bp)} blueprints")
+    results = parallel_map(
+        _text_fields,
+        df_bp["blueprint_code"],
+        workers=workers,
+        desc="Extracting blueprint text",
+    )
+
+    rows = []
+    failed = 0
+    for bp_id, code, title, content, fields in zip(
+        df_bp["id"],
+        df_bp["blueprint_code"],
+        df_bp["topic_title"],
+        df_bp["post_content"],
+        results,
+    ):
+        if not isinstance(fields, dict):
+            failed += 1
+            fields = dict.fromkeys(TEXT_FIELDS)
+        rows.append(
+            {
+                "blueprint_id": int(bp_id),
+                "blueprint_code": code,
+                "topic_title": title,
+                **fields,
+                "post_content": content,
+            }
+        )
+    if failed:
+        warning(f"Indexed {failed} unparsable blueprints without their sections")
+    return db.replace_blueprint_fts(rows)
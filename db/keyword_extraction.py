@@ -1,25 +1,29 @@
 import json
-import pandas as pd
+import multiprocessing
+import os
 from collections import Counter
 import sys
+import time
 from pathlib import Path
+from logging import debug, info, error, warning
 from tqdm import tqdm
-import yake
-from sklearn.feature_extraction.text import TfidfVectorizer
-import numpy as np
 
 # Add the parent directory to the path to import modules
 sys.path.append(str(Path(__file__).parents[1]))
 from db.database import Database
-from util.blueprint import expand_blueprint, extract_keywords
+from util.blueprint import analyze_blueprint
 from util.text_manipulation import (
-    parse_yaml,
+    parse_yaml_cached,
     normalize_text,
     preprocess,
-    tfidf_preprocessing,
-    keywords_remove_input,
+    get_tfidf_preprocessor,
 )
-from util.dataframe_utils import get_dataframes
+from util.parallel import parallel_map
+from util.metrics import measure, record, timed
+
+# Bump whenever the output of process_row changes so that stored keywords
+# produced by an older extractor are recomputed on the next run.
+KEYWORD_EXTRACTOR_VERSION = 2
 
 
 def count_keywords(keywords_section):
@@ -27,10 +31,10 @@ def count_keywords(keywords_section):
 
 
 # Process each row in df_bp and accumulate results
+@timed("keywords.process_row")
 def process_row(row):
-    bp_dict = parse_yaml(row["blueprint_code"])
-    bp_dict_expanded = expand_blueprint(bp_dict)
-    keywords = extract_keywords(bp_dict_expanded)
+    bp_dict = parse_yaml_cached(row["blueprint_code"])
+    keywords = analyze_blueprint(bp_dict).keywords
     # trigger and condition are projected to input becasue they are inputs to the system
     project = {
         "trigger": "input",
@@ -49,140 +53,271 @@ def process_row(row):
     return all_keyword_count
 
 
-def update_blueprint_keywords(db: Database):
-    blueprints = db.get_all_blueprints()
+def _process_code(blueprint_code):
+    try:
+        return process_row({"blueprint_code": blueprint_code}), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
 
-    data = []
-    for bp in blueprints:
-        bp_dict = {
-            "blueprint_id": bp.id,
-            "blueprint_code": bp.blueprint_code,
-        }
-        data.append(bp_dict)
-    df_bp = pd.DataFrame(data)
 
-    # Apply the process to each row and create a new DataFrame from the results
-    keyword_count_dicts = []
-    for _, row in tqdm(
-        df_bp.iterrows(), total=len(df_bp), desc="Extracting keywords from blueprints"
+@timed("keywords.process_rows", rows=len)
+def process_rows(blueprint_codes, workers=1, chunksize=None):
+    """Run process_row over blueprint codes, returning ``(counts, error)`` tuples."""
+    return parallel_map(
+        _process_code,
+        blueprint_codes,
+        workers=workers,
+        chunksize=chunksize,
+        desc="Extracting keywords from blueprints",
+    )
+
+
+def update_blueprint_keywords(db: Database, full=False, workers=1):
+    """Extract keywords of new or changed blueprints and return how many succeeded."""
+    # Index keywords stored before blueprint_keyword existed
+    db.ensure_keyword_index()
+    df_bp = db.get_blueprints_for_keyword_extraction(
+        KEYWORD_EXTRACTOR_VERSION, full=full
+    )
+    df_bp = df_bp.rename(columns={"id": "blueprint_id"})
+    info(f"Extracting keywords for {len(df_bp)} blueprints")
+    if df_bp.empty:
+        return 0
+
+    results = process_rows(df_bp["blueprint_code"], workers=workers)
+
+    keywords = {}
+    provenance = {}
+    failed = 0
+    for bp_id, bp_hash, (keyword_counts, err) in zip(
+        df_bp["blueprint_id"], df_bp["blueprint_hash"], results
     ):
-        keyword_count_dicts.append(process_row(row))
+        if err is not None:
+            # Stored without keywords, retried once the code or extractor changes
+            error(f"Keyword extraction failed for blueprint {bp_id}: {err}")
+            failed += 1
+        keywords[bp_id] = keyword_counts
+        provenance[bp_id] = {
+            "keywords_source_hash": bp_hash,
+            "keywords_extractor_version": KEYWORD_EXTRACTOR_VERSION,
+        }
 
     # Update keyword counts in the database
-    session = db.open_session()
-    for bp_id, keywords in tqdm(
-        zip(df_bp["blueprint_id"], keyword_count_dicts),
-        total=len(df_bp),
-        desc="Updating keyword counts in the database",
-    ):
-        db.update_blueprint_keywords(bp_id, keywords, session)
-    session.commit()
-    session.close()
+    db.write_keywords("extracted_keywords", keywords, extra_columns=provenance)
+    if failed:
+        warning(f"Keyword extraction failed for {failed} of {len(df_bp)} blueprints")
+    return len(keywords) - failed
+
+
+# Post columns read by the YAKE and TF-IDF stages
+POST_TEXT_COLUMNS = ["post_id", "updated_at", "cooked"]
+# Added to YAKE's default stopwords for every topic
+YAKE_STOPWORDS = {"blueprint", "home", "assistant", "automation"}
+# Topics taking longer than this are logged as warnings
+YAKE_SLOW_TOPIC_SECONDS = 10.0
 
+# One configured extractor per process, created by _init_yake_worker
+_yake_extractor = None
 
-def update_blueprint_keywords_yake(db: Database):
-    bp_df, posts_df, topics_df = get_dataframes(db)
-    bp_df["processed_keywords"] = bp_df["extracted_keywords"].apply(
-        keywords_remove_input
+
+def _init_yake_worker():
+    global _yake_extractor
+    import yake
+
+    _yake_extractor = yake.KeywordExtractor(n=2)
+    _yake_extractor.stopword_set = _yake_extractor.stopword_set.union(YAKE_STOPWORDS)
+
+
+def _yake_payload(topic, posts_in_topic, bps_in_topic):
+    """Reduce a topic bundle to the plain data a worker needs."""
+    posts = list(
+        posts_in_topic[["post_id", "updated_at", "cooked"]].itertuples(
+            index=False, name=None
+        )
+    )
+    return (
+        topic["topic_id"],
+        topic["title"],
+        posts,
+        bps_in_topic["description"].tolist(),
     )
 
-    session = db.open_session()
-    try:
-        for _, topic in tqdm(
-            topics_df.iterrows(),
-            total=topics_df.shape[0],
-            desc="Extracting YAKE keywords",
+
+def extract_topic_yake_keywords(payload):
+    """Return ``(topic_id, keywords, seconds)`` for a topic payload."""
+    start = time.perf_counter()
+    topic_id, title, posts, descriptions = payload
+    text = [preprocess(title)]
+    for post_id, updated_at, post in posts:
+        text.append(preprocess(post, (post_id, updated_at)))
+    for description in descriptions:
+        text.append(preprocess(description))
+
+    _kws = _yake_extractor.extract_keywords(". ".join(text))
+    keywords = [kwd for kwd, _ in _kws]
+    return topic_id, keywords, time.perf_counter() - start
+
+
+def _iter_yake_results(payloads, workers, batch_size):
+    if workers == 1:
+        _init_yake_worker()
+        yield from map(extract_topic_yake_keywords, payloads)
+        return
+    with multiprocessing.Pool(workers, initializer=_init_yake_worker) as pool:
+        yield from pool.imap(extract_topic_yake_keywords, payloads, batch_size)
+
+
+def _write_topic_keywords(db: Database, column, keywords):
+    """Store topic keywords on blueprints and their blueprints_filtered rows."""
+    db.write_keywords(column, keywords)
+    db.update_filtered_blueprints(
+        [
+            {"id": int(bp_id), column: json.dumps(value)}
+            for bp_id, value in keywords.items()
+        ]
+    )
+
+
+def update_blueprint_keywords_yake(
+    db: Database, workers=1, batch_size=16, write_batch_size=500
+):
+    """Extract YAKE keyphrases per topic and store the top four per blueprint."""
+    from util.dataframe_utils import iter_topic_bundles
+    from util.snapshot import load_dataframes
+
+    bp_df, posts_df, topics_df = load_dataframes(
+        db,
+        bp_columns=["id", "description"],
+        post_columns=POST_TEXT_COLUMNS,
+        topic_columns=["title"],
+    )
+
+    workers = workers or os.cpu_count()
+    bp_ids_by_topic = {}
+
+    def topic_payloads():
+        for topic, posts_in_topic, bps_in_topic in iter_topic_bundles(
+            topics_df, posts_df, bp_df
         ):
-            posts_in_topic = posts_df[posts_df["topic_id"] == topic["topic_id"]]
-            bps_in_topic = bp_df[bp_df["topic_id"] == topic["topic_id"]]
-
-            yake_kw = yake.KeywordExtractor(n=2)
-            tags_set = set(topic["tags"])
-            proc_keywords = bps_in_topic["processed_keywords"].tolist()
-            proc_keywords = [
-                kwd for sublist in proc_keywords if sublist for kwd in sublist
-            ]
-            yake_kw.stopword_set = yake_kw.stopword_set.union(
-                {"blueprint", "home", "assistant", "automation"}
-                # | tags_set
-                # | set(proc_keywords)
-            )
-
-            text = [preprocess(topic["title"])]
-            for post in posts_in_topic["cooked"].tolist():
-                text.append(preprocess(post))
-            for bp in bps_in_topic["description"].tolist():
-                text.append(preprocess(bp))
-
-            text = ". ".join(text)
-            _kws = yake_kw.extract_keywords(text)
-            keywords = [kwd for kwd, _ in _kws]
-
-            for _, bp in bps_in_topic.iterrows():
-                bp_df.loc[bp_df["id"] == bp["id"], "keywords_yake"] = json.dumps(
-                    keywords[0:4]
-                )
-                db.update_yake_keywords(bp["id"], keywords[0:4], session)
-    finally:
-        session.commit()
-        session.close()
-    bp_df["processed_keywords"] = bp_df["processed_keywords"].apply(json.dumps)
-    db.update_blueprint_filtered_table(bp_df)
+            # Blueprint ids stay in this process, workers only need the text
+            bp_ids_by_topic[topic["topic_id"]] = bps_in_topic["id"].tolist()
+            yield _yake_payload(topic, posts_in_topic, bps_in_topic)
+
+    timings = {}
+    pending = {}
+    processed = 0
+    for topic_id, keywords, seconds in tqdm(
+        _iter_yake_results(topic_payloads(), workers, batch_size),
+        total=topics_df.shape[0],
+        desc="Extracting YAKE keywords",
+    ):
+        timings[topic_id] = seconds
+        # Measured in the worker, which may be another process
+        record(
+            "yake.extract_keywords",
+            wall_seconds=seconds,
+            rows=len(bp_ids_by_topic[topic_id]),
+        )
+        debug(f"YAKE keywords for topic {topic_id} took {seconds:.3f}s")
+        if seconds > YAKE_SLOW_TOPIC_SECONDS:
+            warning(f"Slow YAKE extraction for topic {topic_id}: {seconds:.1f}s")
+
+        for bp_id in bp_ids_by_topic[topic_id]:
+            pending[bp_id] = keywords[0:4]
+        processed += len(bp_ids_by_topic[topic_id])
+        if len(pending) >= write_batch_size:
+            _write_topic_keywords(db, "keywords_yake", pending)
+            pending = {}
+    _write_topic_keywords(db, "keywords_yake", pending)
+
+    slowest = sorted(timings.items(), key=lambda item: item[1], reverse=True)[:10]
+    info(
+        "Slowest YAKE topics: "
+        + ", ".join(f"{topic_id} ({seconds:.2f}s)" for topic_id, seconds in slowest)
+    )
+    return processed
+
+
+@timed("tfidf.top_n_keywords", rows=len)
+def top_n_keywords_table(matrix, features, top_n=2):
+    """Return a DataFrame of the ``top_n`` highest scoring terms per matrix row."""
+    import numpy as np
+    import pandas as pd
+
+    matrix = matrix.tocsr()
+    counts = np.diff(matrix.indptr)
+    rows = np.repeat(np.arange(matrix.shape[0]), counts)
+    order = np.lexsort((matrix.indices, -matrix.data, rows))
+    # Position of each sorted entry within its row
+    rank = np.arange(len(order)) - np.repeat(matrix.indptr[:-1], counts)
+    selected = order[rank < top_n]
+    return pd.DataFrame(
+        {
+            "row": rows[selected],
+            "term": np.asarray(features)[matrix.indices[selected]],
+            "score": matrix.data[selected],
+        }
+    )
 
 
 def extract_top_n_keywords(row, features, top_n=2):
-    row_array = row.toarray().flatten()
-    top_n_indices = np.argsort(row_array)[-top_n:][::-1]
-    top_n_terms = [features[i] for i in top_n_indices]
-    top_n_scores = [row_array[i] for i in top_n_indices]
-    return list(zip(top_n_terms, top_n_scores))
+    table = top_n_keywords_table(row, features, top_n)
+    return list(zip(table["term"], table["score"]))
 
 
 def update_blueprint_keywords_tfidf(db: Database):
-    bp_df, posts_df, topics_df = get_dataframes(db)
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from util.dataframe_utils import iter_topic_bundles
+    from util.snapshot import load_dataframes
 
+    bp_df, posts_df, topics_df = load_dataframes(
+        db,
+        bp_columns=["id", "description", "name"],
+        post_columns=POST_TEXT_COLUMNS,
+        topic_columns=["title", "tags"],
+    )
+
+    preprocessor = get_tfidf_preprocessor()
     corpus = []
-    topic_to_index = {}
-    for idx, (_, topic) in enumerate(
-        tqdm(
-            topics_df.iterrows(),
-            total=topics_df.shape[0],
-            desc="Building TF-IDF corpus",
-        )
+    bp_ids_per_topic = []
+    for topic, posts_in_topic, bps_in_topic in tqdm(
+        iter_topic_bundles(topics_df, posts_df, bp_df),
+        total=topics_df.shape[0],
+        desc="Building TF-IDF corpus",
     ):
-        posts_in_topic = posts_df[posts_df["topic_id"] == topic["topic_id"]]
         texts = posts_in_topic["cooked"].tolist()
         texts.insert(0, topic["title"])
+        cache_keys = list(zip(posts_in_topic["post_id"], posts_in_topic["updated_at"]))
+        cache_keys.insert(0, None)
 
-        bps_in_topic = bp_df[bp_df["topic_id"] == topic["topic_id"]]
         texts.extend(bps_in_topic["description"].tolist())
         texts.extend(bps_in_topic["name"].tolist())
+        cache_keys.extend([None] * (2 * len(bps_in_topic)))
 
         combined_text = " ".join(
-            [tfidf_preprocessing(text, topic["tags"]) for text in texts]
+            preprocessor.transform(texts, topic["tags"], cache_keys)
         )
         corpus.append(combined_text)
-        topic_to_index[topic["topic_id"]] = idx
+        bp_ids_per_topic.append(bps_in_topic["id"].tolist())
 
     tfidf = TfidfVectorizer(min_df=1, max_df=0.95)
-    tfidf_matrix = tfidf.fit_transform(corpus)
+    with measure("tfidf.fit_transform", rows=len(corpus)):
+        tfidf_matrix = tfidf.fit_transform(corpus)
     feature_names = tfidf.get_feature_names_out()
 
-    session = db.open_session()
-    for _, topic in tqdm(
-        topics_df.iterrows(), total=topics_df.shape[0], desc="Updating TF-IDF keywords"
-    ):
-        topic_id = topic["topic_id"]
-        topic_index = topic_to_index[topic_id]
-        row = tfidf_matrix[topic_index]
-        top_keywords = extract_top_n_keywords(row, feature_names, top_n=2)
-        topic_keywords = {kw: score for kw, score in top_keywords}
-
-        bps_in_topic = bp_df[bp_df["topic_id"] == topic_id]
-        for _, bp in bps_in_topic.iterrows():
-            db.update_tfidf_keywords(bp["id"], topic_keywords, session)
-    session.commit()
-    session.close()
+    top_keywords = top_n_keywords_table(tfidf_matrix, feature_names, top_n=2)
+    keywords_per_topic = {
+        topic_index: dict(zip(group["term"], group["score"]))
+        for topic_index, group in top_keywords.groupby("row", sort=False)
+    }
+
+    tfidf_keywords = {}
+    for topic_index, bp_ids in enumerate(bp_ids_per_topic):
+        topic_keywords = keywords_per_topic.get(topic_index, {})
+        for bp_id in bp_ids:
+            tfidf_keywords[bp_id] = topic_keywords
+    _write_topic_keywords(db, "keywords_tfidf", tfidf_keywords)
+    return len(tfidf_keywords)
 
 
 if __name__ == "__main__":
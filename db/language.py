@@ -0,0 +1,43 @@
+import sys
+from pathlib import Path
+from logging import info, error, warning
+
+# Add the parent directory to the path to import modules
+sys.path.append(str(Path(__file__).parents[1]))
+from db.database import Database
+from util.lang_identification import identify_languages
+
+
+def update_blueprint_languages(db: Database, full=False, workers=1):
+    """Detect and store the language of new or changed blueprints."""
+    df_bp = db.get_stale_blueprints("lang_source_hash", full=full)
+    info(f"Identifying the language of {len(df_bp)} blueprints")
+    if df_bp.empty:
+        return 0
+
+    results = identify_languages(df_bp["blueprint_code"], workers=workers)
+    mappings = []
+    failed = 0
+    for bp_id, bp_hash, (result, err) in zip(
+        df_bp["id"], df_bp["blueprint_hash"], results
+    ):
+        if err is not None:
+            error(f"Language identification failed for blueprint {bp_id}: {err}")
+            failed += 1
+            result = (None, None)
+        lang, confidence = result
+        mappings.append(
+            {
+                "id": int(bp_id),
+                "lang": lang,
+                "lang_confidence": confidence,
+                "lang_source_hash": bp_hash,
+            }
+        )
+    db.update_blueprints(mappings)
+    if failed:
+        warning(
+            f"Language identification failed for {failed} of {len(df_bp)} blueprints"
+        )
+    info(f"Updated the language of {len(mappings)} blueprints")
+    return len(mappings)
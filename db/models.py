@@ -2,19 +2,36 @@ from sqlalchemy import (
     create_engine,
     Column,
     Integer,
+    Float,
     String,
     Text,
     DateTime,
     Boolean,
     JSON,
+    LargeBinary,
     ForeignKey,
+    Computed,
+    Index,
     text,
 )
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
 
+# BlueprintFTS columns with a stored tsvector on PostgreSQL, searched through GIN indexes
+FTS_VECTOR_COLUMNS = ("blueprint_expanded", "blueprint_input", "blueprint_action")
+# Seconds a SQLite connection waits for another writer to release the database
+SQLITE_BUSY_TIMEOUT = 300
+
+
+def _tsvector_column(source):
+    return Column(
+        TSVECTOR,
+        Computed(f"to_tsvector('english', coalesce({source}, ''))", persisted=True),
+    )
+
 
 class Topic(Base):
     __tablename__ = "topics"
@@ -105,7 +122,8 @@ class Blueprint(Base):
     __tablename__ = "blueprints"
 
     id = Column(Integer, primary_key=True)
-    blueprint_url = Column(Text)
+    # Not unique, older databases can hold several rows per URL
+    blueprint_url = Column(Text, index=True)
     blueprint_code = Column(Text)
     blueprint_hash = Column(String, unique=True)
     post_id = Column(String, ForeignKey("posts.post_id"))
@@ -115,11 +133,68 @@ class Blueprint(Base):
     topic_keywords = Column(JSON)
     keywords_yake = Column(JSON)
     keywords_tfidf = Column(JSON)
+    # Extractor version and blueprint_hash that produced extracted_keywords
+    keywords_extractor_version = Column(Integer)
+    keywords_source_hash = Column(String)
+    # MinHash signature of the normalized blueprint tree and the hash it was built from
+    minhash_signature = Column(LargeBinary)
+    minhash_source_hash = Column(String)
+    # Language of the blueprint text, its probability and the hash it was detected from
+    lang = Column(String, index=True)
+    lang_confidence = Column(Float)
+    lang_source_hash = Column(String)
+    # Schema validation result, the schema version and the hash it was validated from
+    schema_valid = Column(Boolean, index=True)
+    validation_errors = Column(JSON)
+    validation_schema_version = Column(Integer)
+    validation_source_hash = Column(String)
 
     # Relationship to Post
     post = relationship("Post", back_populates="blueprint")
 
 
+# One row per keyword of Blueprint.extracted_keywords, kept in sync by Database.write_keywords
+class BlueprintKeyword(Base):
+    __tablename__ = "blueprint_keyword"
+
+    blueprint_id = Column(Integer, ForeignKey("blueprints.id"), primary_key=True)
+    # "input" or "output"
+    direction = Column(String, primary_key=True)
+    keyword = Column(String, primary_key=True)
+    count = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_blueprint_keyword_lookup", "direction", "keyword", "count"),
+    )
+
+
+# English blueprints without per-topic near duplicates, maintained by db.filtration
+class BlueprintFiltered(Base):
+    __tablename__ = "blueprints_filtered"
+
+    id = Column(Integer, ForeignKey("blueprints.id"), primary_key=True)
+    blueprint_url = Column(Text)
+    blueprint_code = Column(Text)
+    blueprint_hash = Column(String, index=True)
+    post_id = Column(String)
+    name = Column(String)
+    description = Column(Text)
+    # Keyword columns hold JSON strings, as the notebooks read them
+    extracted_keywords = Column(Text)
+    topic_keywords = Column(Text)
+    keywords_yake = Column(Text)
+    keywords_tfidf = Column(Text)
+    processed_keywords = Column(Text)
+    lang = Column(String)
+    lang_confidence = Column(Float)
+    topic_title = Column(String)
+    topic_id = Column(String, index=True)
+    tags = Column(Text)
+    created_at = Column(DateTime)
+    post_content = Column(Text)
+    updated_at = Column(DateTime)
+
+
 class BlueprintFTS(Base):
     __tablename__ = "blueprints_fts"
 
@@ -133,13 +208,66 @@ class BlueprintFTS(Base):
     blueprint_action = Column(Text)
     blueprint_input = Column(Text)
     post_content = Column(Text)
+    # Generated from the columns above, only on PostgreSQL
+    blueprint_expanded_tsv = _tsvector_column("blueprint_expanded")
+    blueprint_input_tsv = _tsvector_column("blueprint_input")
+    blueprint_action_tsv = _tsvector_column("blueprint_action")
+
+    __table_args__ = tuple(
+        Index(
+            f"ix_blueprints_fts_{column}_tsv",
+            f"{column}_tsv",
+            postgresql_using="gin",
+        )
+        for column in FTS_VECTOR_COLUMNS
+    )
+
+
+# Last successful run of a db.pipeline stage and the state of its inputs at the time
+class PipelineStage(Base):
+    __tablename__ = "pipeline_stages"
+
+    stage = Column(String, primary_key=True)
+    input_state = Column(Text)
+    finished_at = Column(DateTime)
+
+
+def create_model_tables(engine, local):
+    # On SQLite the FTS table is an FTS5 virtual table created by init_database
+    tables = [
+        table
+        for table in Base.metadata.sorted_tables
+        if not (local and table is BlueprintFTS.__table__)
+    ]
+    Base.metadata.create_all(engine, tables=tables)
+
+
+def _add_fts_vector_columns(engine):
+    """Add the generated tsvector columns and GIN indexes to an existing table."""
+    table = BlueprintFTS.__tablename__
+    with engine.begin() as connection:
+        for column in FTS_VECTOR_COLUMNS:
+            connection.execute(
+                text(
+                    f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column}_tsv tsvector "
+                    f"GENERATED ALWAYS AS (to_tsvector('english', coalesce({column}, ''))) STORED"
+                )
+            )
+            connection.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{table}_{column}_tsv "
+                    f"ON {table} USING GIN ({column}_tsv)"
+                )
+            )
 
 
 def init_database(
     database_url, local=False, BLUEPRINTS_FTS_TABLE=None, drop_existing_tables=False
 ):
-    # Create the engine
-    engine = create_engine(database_url, echo=False)
+    # Create the engine. Pipeline stages may write to SQLite from several
+    # processes, so wait for locks instead of failing after the 5 s default.
+    connect_args = {"timeout": SQLITE_BUSY_TIMEOUT} if local else {}
+    engine = create_engine(database_url, echo=False, connect_args=connect_args)
 
     if drop_existing_tables:
         # Drop the tables
@@ -149,9 +277,6 @@ def init_database(
             with engine.connect() as connection:
                 connection.execute(text(f"DROP TABLE IF EXISTS {BLUEPRINTS_FTS_TABLE}"))
 
-    # Create the tables
-    tables_to_create = [Topic, Post, Blueprint]
-
     if local:
         # Create the full text search table
         fts_table_creation_sql = """
@@ -163,9 +288,9 @@ def init_database(
             connection.execute(
                 text(fts_table_creation_sql.format(blueprints_fts=BLUEPRINTS_FTS_TABLE))
             )
-    else:
-        tables_to_create.append(BlueprintFTS)
 
-    Base.metadata.create_all(engine)
+    create_model_tables(engine, local)
+    if not local:
+        _add_fts_vector_columns(engine)
 
     return engine
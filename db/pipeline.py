@@ -0,0 +1,281 @@
+import json
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+from logging import info, error, warning
+from typing import Callable, NamedTuple
+
+from sqlalchemy import func, select
+
+# Add the parent directory to the path to import modules
+sys.path.append(str(Path(__file__).parents[1]))
+from db.database import Database
+from db.deduplication import update_minhash_signatures
+from db.filtration import (
+    DUPLICATE_THRESHOLD,
+    FILTER_LANGUAGE,
+    update_filtered_blueprints,
+)
+from db.fts import update_blueprint_fts
+from db.keyword_extraction import (
+    KEYWORD_EXTRACTOR_VERSION,
+    update_blueprint_keywords,
+    update_blueprint_keywords_tfidf,
+    update_blueprint_keywords_yake,
+)
+from db.language import update_blueprint_languages
+from db.models import Blueprint, Post, Topic
+from db.validation import update_blueprint_validation
+from util.blueprint.schema import SCHEMA_VERSION
+from util import metrics
+from util.cache import content_hash
+
+
+class Stage(NamedTuple):
+    name: str
+    # Called as run(db, full, workers), returns the number of blueprints processed
+    run: Callable
+    # Sources or outputs of other stages the stage reads
+    inputs: tuple[str, ...]
+    outputs: tuple[str, ...]
+    # Bump to rerun the stage once, e.g. when its output format changes
+    version: int = 0
+    # Settings the output depends on, the stage reruns when one changes
+    settings: dict = {}
+
+
+# In dependency order, which is also the order stages run in with one job
+STAGES = (
+    Stage(
+        "validation",
+        lambda db, full, workers: update_blueprint_validation(db, full, workers),
+        inputs=("blueprints",),
+        outputs=("blueprints.schema_valid",),
+        version=SCHEMA_VERSION,
+    ),
+    Stage(
+        "language",
+        lambda db, full, workers: update_blueprint_languages(db, full, workers),
+        inputs=("blueprints",),
+        outputs=("blueprints.lang",),
+    ),
+    Stage(
+        "keywords",
+        lambda db, full, workers: update_blueprint_keywords(db, full, workers),
+        inputs=("blueprints",),
+        outputs=("blueprints.extracted_keywords",),
+        version=KEYWORD_EXTRACTOR_VERSION,
+    ),
+    Stage(
+        "minhash",
+        lambda db, full, workers: update_minhash_signatures(db, full, workers),
+        inputs=("blueprints",),
+        outputs=("blueprints.minhash_signature",),
+    ),
+    Stage(
+        "filtration",
+        lambda db, full, workers: sum(update_filtered_blueprints(db).values()),
+        inputs=(
+            "blueprints",
+            "posts",
+            "topics",
+            "blueprints.lang",
+            "blueprints.extracted_keywords",
+        ),
+        outputs=("blueprints_filtered",),
+        settings={"lang": FILTER_LANGUAGE, "threshold": DUPLICATE_THRESHOLD},
+    ),
+    Stage(
+        "yake",
+        lambda db, full, workers: update_blueprint_keywords_yake(db, workers=workers),
+        inputs=("posts", "topics", "blueprints_filtered"),
+        outputs=("blueprints.keywords_yake",),
+    ),
+    Stage(
+        "tfidf",
+        lambda db, full, workers: update_blueprint_keywords_tfidf(db),
+        inputs=("posts", "topics", "blueprints_filtered"),
+        outputs=("blueprints.keywords_tfidf",),
+    ),
+    Stage(
+        "fts",
+        lambda db, full, workers: update_blueprint_fts(db, workers),
+        inputs=("blueprints", "posts", "topics"),
+        outputs=("blueprints_fts",),
+    ),
+)
+STAGE_NAMES = tuple(stage.name for stage in STAGES)
+# Tables written outside the pipeline, by the crawler, and the column that
+# changes whenever one of their rows does
+SOURCE_TIMESTAMPS = {"posts": Post.updated_at, "topics": Topic.crawled_at}
+
+# Database of a worker process, opened by _init_stage_worker
+_stage_db = None
+
+
+def stage_dependencies(stages=STAGES) -> dict[str, set[str]]:
+    """Return the names of the stages whose outputs each stage reads."""
+    return {
+        stage.name: {
+            other.name for other in stages if set(other.outputs) & set(stage.inputs)
+        }
+        for stage in stages
+    }
+
+
+def _source_states(db: Database) -> dict:
+    with db.engine.connect() as conn:
+        hashes = conn.execute(
+            select(Blueprint.id, Blueprint.blueprint_hash).order_by(Blueprint.id)
+        )
+        states = {
+            "blueprints": content_hash(
+                "\n".join(f"{bp_id}:{bp_hash}" for bp_id, bp_hash in hashes)
+            )
+        }
+        for name, timestamp in SOURCE_TIMESTAMPS.items():
+            rows, latest = conn.execute(select(func.count(), func.max(timestamp))).one()
+            states[name] = [rows, latest.isoformat() if latest else None]
+    return states
+
+
+def _input_state(stage: Stage, dependencies, sources, records) -> str:
+    """Describe what a stage would run on: version, settings, sources, upstream runs."""
+    upstream = {}
+    for name in sorted(dependencies):
+        finished_at = records[name][1] if name in records else None
+        upstream[name] = finished_at.isoformat() if finished_at else None
+    return json.dumps(
+        {
+            "version": stage.version,
+            "settings": stage.settings,
+            "sources": {
+                name: sources[name] for name in stage.inputs if name in sources
+            },
+            "upstream": upstream,
+        },
+        sort_keys=True,
+    )
+
+
+def _database_kwargs(db: Database) -> dict:
+    return {
+        "database_name": db.database_name,
+        "blueprints_fts_table": db.blueprints_fts_table,
+        "postgresql_host_name": db.postqresql_host_name,
+        "postgresql_db_name": db.postgresql_db_name,
+        "local": db.local,
+    }
+
+
+def _init_stage_worker(database_kwargs):
+    global _stage_db
+    _stage_db = Database(**database_kwargs)
+
+
+def _run_stage(name, full, workers, db=None):
+    """Run a stage, in a worker process unless ``db`` is given."""
+    if db is None:
+        metrics.reset()
+    with metrics.measure(f"stage.{name}") as span:
+        span.rows = STAGES[STAGE_NAMES.index(name)].run(db or _stage_db, full, workers)
+    return metrics.snapshot() if db is None else None
+
+
+def run_pipeline(
+    db: Database, stages=None, workers=1, jobs=1, full=False, force=False
+) -> dict[str, str]:
+    """Run the selected stages whose inputs changed, returning ``{stage: status}``."""
+    if stages is None:
+        stages = STAGE_NAMES
+    unknown = set(stages) - set(STAGE_NAMES)
+    if unknown:
+        raise ValueError(f"Invalid stages: {', '.join(sorted(unknown))}")
+    dependencies = stage_dependencies()
+    records = db.get_pipeline_stages()
+    sources = _source_states(db)
+    pending = [stage for stage in STAGES if stage.name in stages]
+    running = {}
+    results = {}
+
+    def finish(name, input_state, exc=None):
+        if exc is not None:
+            error(f"Stage {name} failed: {exc}", exc_info=exc)
+            results[name] = "failed"
+            return
+        finished_at = datetime.now()
+        db.record_pipeline_stage(name, input_state, finished_at)
+        records[name] = (input_state, finished_at)
+        results[name] = "ran"
+        info(f"Stage {name} finished")
+
+    def start(stage):
+        """Run or submit a stage, returning its future if it runs in a worker."""
+        failed = [
+            name
+            for name in dependencies[stage.name]
+            if results.get(name) in ("failed", "blocked")
+        ]
+        if failed:
+            warning(f"Skipping stage {stage.name}, {failed[0]} failed")
+            results[stage.name] = "blocked"
+            return None
+
+        input_state = _input_state(stage, dependencies[stage.name], sources, records)
+        if (
+            not (full or force)
+            and stage.name in records
+            and records[stage.name][0] == input_state
+        ):
+            info(f"Stage {stage.name} is up to date")
+            results[stage.name] = "fresh"
+            return None
+
+        info(f"Running stage {stage.name}")
+        if executor is not None:
+            future = executor.submit(_run_stage, stage.name, full, workers)
+            running[future] = (stage.name, input_state)
+            return future
+        try:
+            _run_stage(stage.name, full, workers, db)
+        except Exception as e:
+            finish(stage.name, input_state, e)
+        else:
+            finish(stage.name, input_state)
+        return None
+
+    executor = None
+    if jobs > 1:
+        executor = ProcessPoolExecutor(
+            jobs, initializer=_init_stage_worker, initargs=(_database_kwargs(db),)
+        )
+    try:
+        while pending or running:
+            unfinished = {stage.name for stage in pending}
+            unfinished |= {name for name, _ in running.values()}
+            for stage in list(pending):
+                if dependencies[stage.name] & unfinished:
+                    continue
+                pending.remove(stage)
+                future = start(stage)
+                if future is None:
+                    # Done already, later stages of this pass may depend on it
+                    unfinished.discard(stage.name)
+
+            if running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    exc = future.exception()
+                    if exc is None:
+                        metrics.merge(future.result())
+                    finish(*running.pop(future), exc)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    info(
+        "Pipeline finished: "
+        + ", ".join(f"{name} {status}" for name, status in results.items())
+    )
+    return results
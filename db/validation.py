@@ -0,0 +1,45 @@
+import sys
+from pathlib import Path
+from logging import info, warning
+
+# Add the parent directory to the path to import modules
+sys.path.append(str(Path(__file__).parents[1]))
+from db.database import Database
+from db.models import Blueprint
+from util.blueprint import validate_blueprints
+from util.blueprint.schema import SCHEMA_VERSION
+
+
+def update_blueprint_validation(db: Database, full=False, workers=1):
+    """Validate new or changed blueprints against the blueprint schema."""
+    df_bp = db.get_stale_blueprints(
+        "validation_source_hash",
+        Blueprint.validation_schema_version.is_(None),
+        Blueprint.validation_schema_version != SCHEMA_VERSION,
+        full=full,
+    )
+    info(f"Validating {len(df_bp)} blueprints")
+    if df_bp.empty:
+        return 0
+
+    results = validate_blueprints(
+        df_bp["blueprint_code"], df_bp["blueprint_hash"], workers=workers
+    )
+    db.update_blueprints(
+        [
+            {
+                "id": int(bp_id),
+                "schema_valid": not errors,
+                "validation_errors": errors,
+                "validation_schema_version": SCHEMA_VERSION,
+                "validation_source_hash": bp_hash,
+            }
+            for bp_id, bp_hash, errors in zip(
+                df_bp["id"], df_bp["blueprint_hash"], results
+            )
+        ]
+    )
+    invalid = sum(1 for errors in results if errors)
+    if invalid:
+        warning(f"{invalid} of {len(results)} blueprints don't match the schema")
+    return len(results)
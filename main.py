@@ -1,71 +1,112 @@
 from db.database import Database
-from db.keyword_extraction import (
-    update_blueprint_keywords,
-    update_blueprint_keywords_tfidf,
-    update_blueprint_keywords_yake,
-)
+from db.pipeline import STAGE_NAMES, run_pipeline
+from util import metrics
+from util.profiler import sampling_profiler
+from datetime import datetime
+from pathlib import Path
 import logging
 import argparse
-from sqlalchemy.sql import text
-from sqlalchemy import inspect
+import os
+import sys
 
-parser = argparse.ArgumentParser(
-    description="Fetch and store topics from Home Assistant Community Forum."
-)
-""" parser.add_argument(
-    "--fetch-new",
-    action="store_true",
-    help="Fetch and store the new topics in the blueprint-exchange category.",
-)
-parser.add_argument(
-    "--fetch-all",
-    action="store_true",
-    help="Fetch and store all topics in the blueprint-exchange category. Default is to fetch only the latest topics.",
-) """
-parser.add_argument(
-    "--debug",
-    action="store_true",
-    help="Enable debug logging.",
-)
-""" parser.add_argument(
-    "--db-local",
-    action="store_true",
-    help="Use a local database file instead of the default remote URL.",
-) """
-args = parser.parse_args()
 
-# Configure logging
-logging.basicConfig(
-    filename="main.log", level=logging.DEBUG if args.debug else logging.INFO
-)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Fetch and store topics from Home Assistant Community Forum."
+    )
+    """ parser.add_argument(
+        "--fetch-new",
+        action="store_true",
+        help="Fetch and store the new topics in the blueprint-exchange category.",
+    )
+    parser.add_argument(
+        "--fetch-all",
+        action="store_true",
+        help="Fetch and store all topics in the blueprint-exchange category. Default is to fetch only the latest topics.",
+    ) """
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="Enable debug logging.",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Run the selected stages and recompute every blueprint instead of only new or changed ones.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Run the selected stages even if their outputs are up to date.",
+    )
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=STAGE_NAMES,
+        default=list(STAGE_NAMES),
+        help="Pipeline stages to run. Default is all of them.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes per stage. 0 uses all CPUs.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of independent stages to run at the same time.",
+    )
+    parser.add_argument(
+        "--metrics-dir",
+        default=os.getenv("METRICS_DIR"),
+        help="Directory for the run report (report.json) and Prometheus textfile "
+        "(bp_classification.prom). Defaults to the METRICS_DIR environment variable.",
+    )
+    """ parser.add_argument(
+        "--db-local",
+        action="store_true",
+        help="Use a local database file instead of the default remote URL.",
+    ) """
+    return parser.parse_args(argv)
 
 
-def main():
-    try:
-        db = Database(local=True, drop_existing_tables=False)
+def main(argv=None):
+    args = parse_args(argv)
 
-        with db.engine.connect() as connection:
-            inspector = inspect(connection)
-            columns = [col["name"] for col in inspector.get_columns("blueprints")]
-            if "topic_keywords" not in columns:
-                connection.execute(
-                    text("ALTER TABLE blueprints ADD COLUMN topic_keywords JSON")
-                )
-            if "keywords_yake" not in columns:
-                connection.execute(
-                    text("ALTER TABLE blueprints ADD COLUMN keywords_yake JSON")
-                )
-            if "keywords_tfidf" not in columns:
-                connection.execute(
-                    text("ALTER TABLE blueprints ADD COLUMN keywords_tfidf JSON")
-                )
+    # Configure logging
+    logging.basicConfig(
+        filename="main.log", level=logging.DEBUG if args.debug else logging.INFO
+    )
 
-        update_blueprint_keywords(db)
-        # update_blueprint_keywords_tfidf(db)
-        update_blueprint_keywords_yake(db)
-    except Exception as e:
-        logging.error(str(e))
+    started_at = datetime.now()
+    with sampling_profiler():
+        db = Database(local=True, drop_existing_tables=False)
+        results = run_pipeline(
+            db,
+            args.stages,
+            workers=args.workers,
+            jobs=args.jobs,
+            full=args.full,
+            force=args.force,
+        )
+    if args.metrics_dir:
+        metrics_dir = Path(args.metrics_dir)
+        metrics_dir.mkdir(parents=True, exist_ok=True)
+        metrics.write_report(
+            metrics_dir / "report.json",
+            started_at=started_at.isoformat(),
+            argv=sys.argv[1:] if argv is None else argv,
+            stages=results,
+        )
+        metrics.write_prometheus(metrics_dir / "bp_classification.prom")
+    failed = [stage for stage, status in results.items() if status == "failed"]
+    if failed:
+        print(f"Failed stages: {', '.join(failed)}, see main.log", file=sys.stderr)
+        return 1
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
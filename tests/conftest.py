@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Add the parent directory to the path to import modules
+sys.path.append(str(Path(__file__).parents[1]))
@@ -0,0 +1,67 @@
+import random
+from copy import deepcopy
+
+import pytest
+
+from util.blueprint import analyze_blueprint, expand_blueprint, extract_keywords
+from util.text_manipulation import parse_yaml
+
+KEYS = ("trigger", "condition", "action", "domain", "integration", "data", "entity_id")
+INPUTS = ("a", "b", "missing")
+
+
+def legacy_keywords(blueprint_dict):
+    return extract_keywords(expand_blueprint(deepcopy(blueprint_dict)))
+
+
+def random_node(rng, depth):
+    choice = rng.random()
+    if depth == 0 or choice < 0.3:
+        return rng.choice(["light", "sensor", 3, None])
+    if choice < 0.45:
+        return {"!input": rng.choice(INPUTS)}
+    if choice < 0.7:
+        return [random_node(rng, depth - 1) for _ in range(rng.randint(0, 3))]
+    return {
+        rng.choice(KEYS): random_node(rng, depth - 1) for _ in range(rng.randint(1, 3))
+    }
+
+
+def random_blueprint(rng):
+    return {
+        "blueprint": {
+            "name": "random",
+            "input": {
+                "a": {"selector": {"entity": {"domain": "light"}}},
+                "b": "switch",
+            },
+        },
+        **{section: random_node(rng, 4) for section in ("trigger", "action")},
+    }
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        # List items referencing inputs
+        "trigger:\n  - domain: [!input a, light]",
+        # Inputs nested in a dict-valued keyword attribute
+        "trigger:\n  - domain:\n      entity: !input a\n      other: [!input b]",
+        # References to undeclared inputs are kept
+        "action:\n  - integration: {entity: !input missing}",
+    ],
+)
+def test_keywords_resolve_inputs_like_expansion(code):
+    blueprint_dict = parse_yaml(
+        "blueprint:\n  input:\n    a:\n      selector: {entity: {}}\n    b: x\n" + code
+    )
+    assert analyze_blueprint(blueprint_dict).keywords == legacy_keywords(blueprint_dict)
+
+
+def test_keywords_match_expansion_on_random_blueprints():
+    rng = random.Random(0)
+    for _ in range(2000):
+        blueprint_dict = random_blueprint(rng)
+        assert analyze_blueprint(blueprint_dict).keywords == legacy_keywords(
+            blueprint_dict
+        )
@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+
+from db.database import Database
+
+
+def blueprint_rows(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute(
+            "SELECT id, blueprint_url, blueprint_hash FROM blueprints ORDER BY id"
+        ).fetchall()
+
+
+def test_open_database_with_duplicate_blueprint_urls(tmp_path):
+    path = str(tmp_path / "blueprints.sqlite")
+    db = Database(database_name=path)
+    session = db.open_session()
+    # The crawler could store a URL twice this way
+    db.upsert_blueprint(session, "u1", blueprint_hash="h1", blueprint_code="a: 1")
+    db.upsert_blueprint(
+        session, "u1", force_insert=True, blueprint_hash="h2", blueprint_code="a: 2"
+    )
+    session.commit()
+    session.close()
+    with sqlite3.connect(path) as conn:
+        conn.execute("DROP INDEX IF EXISTS ix_blueprints_blueprint_url")
+
+    db = Database(database_name=path)
+
+    counts = db.upsert_blueprints(
+        [
+            {"blueprint_url": "u1", "blueprint_hash": "h3", "blueprint_code": "a: 3"},
+            {"blueprint_url": "u2", "blueprint_hash": "h4", "blueprint_code": "a: 4"},
+        ]
+    )
+    assert counts == {"inserted": 1, "updated": 1}
+    assert blueprint_rows(path) == [(1, "u1", "h3"), (2, "u1", "h2"), (3, "u2", "h4")]
+
+
+def test_upsert_blueprints_rejects_rows_without_url(tmp_path):
+    db = Database(database_name=str(tmp_path / "blueprints.sqlite"))
+    with pytest.raises(ValueError):
+        db.upsert_blueprints([{"blueprint_url": None, "blueprint_hash": "h1"}])
+
+
+def test_search_keywords_stored_before_keyword_index(tmp_path):
+    path = str(tmp_path / "blueprints.sqlite")
+    db = Database(database_name=path)
+    db.upsert_blueprints(
+        [
+            {"blueprint_url": "u1", "blueprint_hash": "h1"},
+            {"blueprint_url": "u2", "blueprint_hash": "h2"},
+        ]
+    )
+    # Written by older code, which didn't fill blueprint_keyword
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "UPDATE blueprints SET extracted_keywords = ? WHERE id = 1",
+            ('{"input__light": 2, "output__notify": 1}',),
+        )
+
+    results = db.search_blueprint_by_keywords("light", ">=", 2, "notify", "==", 1)
+
+    assert [bp.id for bp in results] == [1]
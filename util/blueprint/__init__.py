@@ -3,6 +3,8 @@ from logging import debug
 from .schema import BLUEPRINT_SCHEMA
 from .expand import replace_input_tags
 from .extract_keywords import extract_keywords
+from .analyze import analyze_blueprint
+from .validation import blueprint_errors, validate_blueprints
 
 
 def validate_blueprint(blueprint_dict):
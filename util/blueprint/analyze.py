@@ -0,0 +1,171 @@
+from copy import deepcopy
+from typing import Any, NamedTuple
+
+from .expand import replace_input_tags
+
+SECTIONS = ("trigger", "condition", "action")
+KEYWORD_ATTRIBUTES = ("integration", "domain", "device_class")
+# Keys of the blueprint declaration dropped by remove_declaration
+REMOVED_DECLARATION_KEYS = ("input", "source_url", "domain")
+# Text fields in the order of the BlueprintFTS columns
+TEXT_FIELDS = (
+    "blueprint_expanded",
+    "blueprint_declaraion",
+    "blueprint_trigger",
+    "blueprint_condition",
+    "blueprint_action",
+    "blueprint_input",
+)
+
+_NO_INPUTS = object()
+
+
+class BlueprintAnalysis(NamedTuple):
+    # Same as extract_keywords(expand_blueprint(blueprint_dict))
+    keywords: dict[str, list]
+    # FTS text fields, only when requested
+    text: dict[str, str] | None
+
+
+def _contains_input_tag(node) -> bool:
+    if isinstance(node, dict):
+        return "!input" in node or any(
+            _contains_input_tag(value) for value in node.values()
+        )
+    if isinstance(node, list):
+        return any(_contains_input_tag(item) for item in node)
+    return False
+
+
+def _needs_expansion(blueprint_dict) -> bool:
+    """Whether only the deepcopy-based expansion reproduces the legacy output."""
+    if not isinstance(blueprint_dict, dict):
+        return True
+    declaration = blueprint_dict.get("blueprint")
+    if not isinstance(declaration, dict):
+        return True
+    if "input" not in declaration:
+        return False
+    inputs = declaration["input"]
+    return not isinstance(inputs, dict) or _contains_input_tag(inputs)
+
+
+class _Analyzer:
+    """Walks a blueprint once, like extract_keywords walks an expanded one."""
+
+    def __init__(self, inputs, collect_text):
+        self.inputs = inputs
+        self.keywords = {section: [] for section in SECTIONS}
+        self.leaves = [] if collect_text else None
+
+    def resolve(self, value):
+        if (
+            self.inputs is not _NO_INPUTS
+            and isinstance(value, dict)
+            and "!input" in value
+            and value["!input"] in self.inputs
+        ):
+            return self.inputs[value["!input"]]
+        return value
+
+    def resolve_nested(self, value):
+        """Resolve references anywhere in a value, copying only what changes."""
+        if self.inputs is _NO_INPUTS or not _contains_input_tag(value):
+            return value
+        if isinstance(value, dict):
+            if "!input" in value:
+                return self.resolve(value)
+            return {key: self.resolve_nested(item) for key, item in value.items()}
+        return [self.resolve_nested(item) for item in value]
+
+    def walk_value(self, value, section):
+        resolved = self.resolve(value)
+        if resolved is value and isinstance(value, dict) and "!input" in value:
+            # The expansion leaves unknown references as they are, including
+            # any references nested in them
+            inputs, self.inputs = self.inputs, _NO_INPUTS
+            self.walk(value, section)
+            self.inputs = inputs
+        else:
+            self.walk(resolved, section)
+
+    def visit(self, key, value, section):
+        """Handle one dict entry and return the section for its later siblings."""
+        # Check if the current key indicates a new section and update accordingly
+        if key in SECTIONS:
+            section = key
+        elif key in ["wait_for_trigger", "data"]:
+            section = "condition"
+        elif key == "variables":
+            section = ""
+        elif key in KEYWORD_ATTRIBUTES and section:
+            # Keywords are stored, so references nested in them are resolved too
+            keywords = self.resolve_nested(value)
+            if isinstance(keywords, list):
+                self.keywords[section].extend(keywords)
+            else:
+                self.keywords[section].append(keywords)
+        self.walk_value(value, section)
+        return section
+
+    def walk(self, node, section=None):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                section = self.visit(key, value, section)
+        elif isinstance(node, list):
+            for item in node:
+                self.walk_value(item, section)
+        elif self.leaves is not None and node is not None:
+            self.leaves.append(str(node))
+
+
+def _leaf_text(node) -> str:
+    analyzer = _Analyzer(_NO_INPUTS, collect_text=True)
+    analyzer.walk(node)
+    return " ".join(analyzer.leaves)
+
+
+def _analyze(blueprint_dict, inputs, declared_inputs, collect_text):
+    analyzer = _Analyzer(inputs, collect_text)
+    text = {field: [] for field in TEXT_FIELDS}
+    section = None
+    for key, value in blueprint_dict.items():
+        if key == "blueprint":
+            value = {
+                prop: prop_value
+                for prop, prop_value in value.items()
+                if prop not in REMOVED_DECLARATION_KEYS
+            }
+            field = "blueprint_declaraion"
+        elif key in SECTIONS:
+            field = f"blueprint_{key}"
+        else:
+            continue
+        if collect_text:
+            analyzer.leaves = text[field]
+        section = analyzer.visit(key, value, section)
+
+    if not collect_text:
+        return BlueprintAnalysis(analyzer.keywords, None)
+    fields = {field: " ".join(leaves) for field, leaves in text.items()}
+    fields["blueprint_expanded"] = " ".join(
+        fields[field] for field in TEXT_FIELDS[1:5] if fields[field]
+    )
+    if isinstance(declared_inputs, dict):
+        fields["blueprint_input"] = _leaf_text(declared_inputs)
+    return BlueprintAnalysis(analyzer.keywords, fields)
+
+
+def analyze_blueprint(blueprint_dict: Any, text: bool = False) -> BlueprintAnalysis:
+    """Collect section keywords and optionally FTS text of a blueprint in one pass."""
+    if _needs_expansion(blueprint_dict):
+        declared_inputs = None
+        if isinstance(blueprint_dict, dict) and isinstance(
+            blueprint_dict.get("blueprint"), dict
+        ):
+            declared_inputs = deepcopy(blueprint_dict["blueprint"].get("input"))
+        expanded = replace_input_tags(deepcopy(blueprint_dict))
+        return _analyze(expanded, _NO_INPUTS, declared_inputs, text)
+
+    inputs = blueprint_dict["blueprint"].get("input", _NO_INPUTS)
+    return _analyze(blueprint_dict, inputs, inputs, text)
@@ -22,6 +22,9 @@ from .const import (
 
 _T = TypeVar("_T")
 
+# Bump whenever BLUEPRINT_SCHEMA changes so that cached validation results are discarded
+SCHEMA_VERSION = 1
+
 
 def version_validator(value: Any) -> str:
     """Validate a Home Assistant version."""
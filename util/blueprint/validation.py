@@ -0,0 +1,68 @@
+import os
+from typing import Any, Iterable
+
+import voluptuous as vol
+
+from ..cache import ContentCache, content_hash
+from ..parallel import parallel_map
+from ..text_manipulation import parse_yaml_cached
+from .schema import BLUEPRINT_SCHEMA, SCHEMA_VERSION
+
+_validation_cache = ContentCache(
+    maxsize=int(os.getenv("VALIDATION_CACHE_SIZE", "8192")),
+    cache_dir=os.getenv("VALIDATION_CACHE_DIR"),
+)
+
+
+def _error_record(path, message) -> dict[str, Any]:
+    return {"path": [str(part) for part in path], "message": message}
+
+
+def blueprint_errors(blueprint_dict) -> list[dict[str, Any]]:
+    """Validate a parsed blueprint and return one record per schema error."""
+    try:
+        BLUEPRINT_SCHEMA(blueprint_dict)
+    except vol.MultipleInvalid as e:
+        return [_error_record(error.path, error.msg) for error in e.errors]
+    except vol.Invalid as e:
+        return [_error_record(e.path, e.msg)]
+    return []
+
+
+def validate_blueprint_code(blueprint_code) -> list[dict[str, Any]]:
+    """Parse and validate blueprint YAML, see blueprint_errors."""
+    try:
+        blueprint_dict = parse_yaml_cached(blueprint_code)
+        if blueprint_dict is None:
+            return [_error_record([], "Invalid YAML")]
+        return blueprint_errors(blueprint_dict)
+    except Exception as e:
+        return [_error_record([], f"{type(e).__name__}: {e}")]
+
+
+def _cache_key(blueprint_hash) -> str:
+    return f"schema{SCHEMA_VERSION}-{blueprint_hash}"
+
+
+def validate_blueprints(
+    blueprint_codes: Iterable[str], blueprint_hashes=None, workers=1, chunksize=None
+) -> list[list[dict[str, Any]]]:
+    """Validate many blueprints and return their error records in input order."""
+    blueprint_codes = list(blueprint_codes)
+    if blueprint_hashes is None:
+        blueprint_hashes = [content_hash(code) for code in blueprint_codes]
+    keys = [_cache_key(blueprint_hash) for blueprint_hash in blueprint_hashes]
+
+    results = [_validation_cache.get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    computed = parallel_map(
+        validate_blueprint_code,
+        [blueprint_codes[i] for i in missing],
+        workers=workers,
+        chunksize=chunksize,
+        desc="Validating blueprints",
+    )
+    for i, errors in zip(missing, computed):
+        _validation_cache.set(keys[i], errors)
+        results[i] = errors
+    return results
@@ -0,0 +1,85 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+from logging import debug
+from pathlib import Path
+from threading import Lock
+
+_MISSING = object()
+
+
+def content_hash(text: str) -> str:
+    """Return the SHA-256 hex digest of a string."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ContentCache:
+    """Key-value cache with LRU eviction in memory and optional disk persistence."""
+
+    def __init__(self, maxsize: int = 2048, cache_dir: str | Path | None = None):
+        self.maxsize = maxsize
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.pickle"
+
+    def _remember(self, key: str, data: bytes):
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _load(self, key: str) -> bytes | None:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data
+        if self.cache_dir is None:
+            return None
+        try:
+            data = self._path(key).read_bytes()
+        except OSError:
+            return None
+        self._remember(key, data)
+        return data
+
+    def get(self, key: str, default=None):
+        data = self._load(key)
+        if data is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(data)
+
+    def set(self, key: str, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._remember(key, data)
+        if self.cache_dir is None:
+            return
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first so readers never see partial data
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            debug(f"Could not persist cache entry {key}: {e}")
+
+    def get_or_compute(self, key: str, func, *args):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = func(*args)
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
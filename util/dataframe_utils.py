@@ -1,29 +1,145 @@
 import pandas as pd
+from sqlalchemy import select
 from db.database import Database
-from typing import Any
+from db.models import BlueprintFiltered, Post, Topic
+from typing import Any, Iterator
 
+# Rows per read from the database
+DATAFRAME_CHUNK_SIZE = 5000
+# Topics per batch when iterating per-topic bundles
+TOPICS_PER_BATCH = 500
 
-def get_dataframes(db: Database) -> tuple[Any, Any, Any]:
-    bp_df = db.get_filtered_bps()
-    posts = {post.post_id: post for post in db.get_posts()}
-    topics = {topic.topic_id: topic for topic in db.get_topics()}
 
-    posts_df = pd.DataFrame(
-        [
-            {_attr: getattr(post, _attr) for _attr in post.__dict__.keys()}
-            for post in posts.values()
+def _projection(model, columns):
+    """Return the selected table columns, always including topic_id."""
+    table = model.__table__
+    if columns is None:
+        return list(table.columns)
+    names = list(dict.fromkeys(["topic_id", *columns]))
+    return [table.columns[name] for name in names]
+
+
+def _compact(df: pd.DataFrame, topic_dtype) -> pd.DataFrame:
+    df["topic_id"] = df["topic_id"].astype(topic_dtype)
+    for column in df.columns:
+        if pd.api.types.is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+    return df
+
+
+def read_frame(db: Database, stmt, topic_dtype, chunksize) -> pd.DataFrame:
+    """Read a SELECT in chunks, compacting each chunk before concatenating."""
+    with db.engine.connect() as conn:
+        chunks = [
+            _compact(chunk, topic_dtype)
+            for chunk in pd.read_sql(stmt, conn, chunksize=chunksize)
         ]
+    if not chunks:
+        columns = [column.name for column in stmt.selected_columns]
+        return _compact(pd.DataFrame(columns=columns), topic_dtype)
+    df = pd.concat(chunks, ignore_index=True)
+    if "tags" in df.columns:
+        df["tags"] = df["tags"].astype("category")
+    return df
+
+
+def _read_frames(
+    db: Database,
+    topic_ids,
+    bp_columns,
+    post_columns,
+    topic_columns,
+    chunksize,
+    batch=False,
+):
+    """Read the three frames for the given topics."""
+    topic_dtype = pd.CategoricalDtype(sorted(topic_ids))
+    topic_filter = topic_ids if batch else filtered_topic_ids_query()
+    bp_stmt = select(*_projection(BlueprintFiltered, bp_columns))
+    if batch:
+        bp_stmt = bp_stmt.where(BlueprintFiltered.topic_id.in_(topic_filter))
+    bp_df = read_frame(
+        db, bp_stmt.order_by(BlueprintFiltered.id), topic_dtype, chunksize
     )
-    topics_df = pd.DataFrame(
-        [
-            {_attr: getattr(topic, _attr) for _attr in topic.__dict__.keys()}
-            for topic in topics.values()
-        ]
+    posts_df = read_frame(
+        db,
+        select(*_projection(Post, post_columns))
+        .where(Post.topic_id.in_(topic_filter))
+        .order_by(Post.id),
+        topic_dtype,
+        chunksize,
+    )
+    topics_df = read_frame(
+        db,
+        select(*_projection(Topic, topic_columns))
+        .where(Topic.topic_id.in_(topic_filter))
+        .order_by(Topic.id),
+        topic_dtype,
+        chunksize,
+    )
+    return bp_df, posts_df, topics_df
+
+
+def filtered_topic_ids_query():
+    return (
+        select(BlueprintFiltered.topic_id)
+        .where(BlueprintFiltered.topic_id.is_not(None))
+        .distinct()
     )
 
-    _filtered_topics = bp_df["topic_id"].unique().tolist()
 
-    topics_df = topics_df[topics_df["topic_id"].isin(_filtered_topics)]
-    posts_df = posts_df[posts_df["topic_id"].isin(_filtered_topics)]
+def _filtered_topic_ids(db: Database) -> list[str]:
+    with db.engine.connect() as conn:
+        return conn.execute(filtered_topic_ids_query()).scalars().all()
 
-    return bp_df, posts_df, topics_df
+
+def get_dataframes(
+    db: Database,
+    bp_columns=None,
+    post_columns=None,
+    topic_columns=None,
+    chunksize=DATAFRAME_CHUNK_SIZE,
+    by_topic=False,
+) -> tuple[Any, Any, Any] | Iterator:
+    """Load filtered blueprints and the posts and topics of their topics."""
+    topic_ids = _filtered_topic_ids(db)
+    if by_topic:
+        return _iter_topic_batches(
+            db, topic_ids, bp_columns, post_columns, topic_columns, chunksize
+        )
+    return _read_frames(
+        db, topic_ids, bp_columns, post_columns, topic_columns, chunksize
+    )
+
+
+def _iter_topic_batches(
+    db: Database, topic_ids, bp_columns, post_columns, topic_columns, chunksize
+):
+    for start in range(0, len(topic_ids), TOPICS_PER_BATCH):
+        bp_df, posts_df, topics_df = _read_frames(
+            db,
+            topic_ids[start : start + TOPICS_PER_BATCH],
+            bp_columns,
+            post_columns,
+            topic_columns,
+            chunksize,
+            batch=True,
+        )
+        yield from iter_topic_bundles(topics_df, posts_df, bp_df)
+
+
+def iter_topic_bundles(topics_df, posts_df, bp_df):
+    """Yield ``(topic, posts_in_topic, bps_in_topic)`` for every topic row."""
+    posts_by_topic = dict(
+        tuple(posts_df.groupby("topic_id", sort=False, observed=True))
+    )
+    bps_by_topic = dict(tuple(bp_df.groupby("topic_id", sort=False, observed=True)))
+    no_posts = posts_df.iloc[0:0]
+    no_bps = bp_df.iloc[0:0]
+    for _, topic in topics_df.iterrows():
+        topic_id = topic["topic_id"]
+        yield (
+            topic,
+            posts_by_topic.get(topic_id, no_posts),
+            bps_by_topic.get(topic_id, no_bps),
+        )
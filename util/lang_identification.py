@@ -1,9 +1,52 @@
-import langid
-from .text_manipulation import parse_yaml, get_leaf_values
+from .text_manipulation import parse_yaml_cached, get_leaf_values
+from .parallel import parallel_map
+
+# Identifier with normalized probabilities, created on first use per process
+_identifier = None
+
+
+def _get_identifier():
+    global _identifier
+    if _identifier is None:
+        from langid.langid import LanguageIdentifier, model
+
+        _identifier = LanguageIdentifier.from_modelstring(model, norm_probs=True)
+    return _identifier
+
+
+def blueprint_text(bp_code) -> str:
+    """Join the leaf values of a blueprint into one text."""
+    bp_code_parsed = parse_yaml_cached(bp_code)
+    return " ".join(str(value) for value in get_leaf_values(bp_code_parsed))
 
 
 def identify_language_yaml(bp_code) -> str:
-    bl_code_parsed = parse_yaml(bp_code)
-    bp_text = " ".join(str(value) for value in get_leaf_values(bl_code_parsed))
+    import langid
+
+    bp_text = blueprint_text(bp_code)
     language = langid.classify(bp_text)[0]
     return language
+
+
+def identify_language_with_confidence(bp_code) -> tuple[str, float]:
+    """Return the language of a blueprint and its probability between 0 and 1."""
+    language, confidence = _get_identifier().classify(blueprint_text(bp_code))
+    return language, float(confidence)
+
+
+def _identify_code(bp_code):
+    try:
+        return identify_language_with_confidence(bp_code), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def identify_languages(bp_codes, workers=1, chunksize=None) -> list[tuple]:
+    """Identify the language of many blueprints, optionally in a process pool."""
+    return parallel_map(
+        _identify_code,
+        bp_codes,
+        workers=workers,
+        chunksize=chunksize,
+        desc="Identifying blueprint languages",
+    )
@@ -0,0 +1,184 @@
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from functools import wraps
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Prefix of the metric names in the Prometheus textfile
+PROMETHEUS_PREFIX = "bp_classification"
+# Spans shorter than this report the previous peak RSS reading
+RSS_SAMPLE_SECONDS = 0.01
+# Per-name totals: calls, wall and CPU seconds, rows and DB statements, and
+# the process peak RSS when one of the calls ended. The peak is a high-water
+# mark since the process started, so it includes memory used before the
+# call; it shows which call raised it, not how much memory the call used.
+_metrics = {}
+# SQL statements executed by instrumented engines in this process
+_statements = 0
+_peak_rss = 0
+
+
+def _new_entry():
+    return {
+        "calls": 0,
+        "wall_seconds": 0.0,
+        "cpu_seconds": 0.0,
+        "rows": 0,
+        "db_statements": 0,
+        "peak_rss_bytes": 0,
+    }
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process or its largest finished child."""
+    if resource is None:
+        return 0
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def record(name, calls=1, wall_seconds=0.0, cpu_seconds=0.0, rows=0, db_statements=0):
+    """Add a measurement that was taken elsewhere, e.g. in a worker process."""
+    entry = _metrics.get(name)
+    if entry is None:
+        entry = _metrics[name] = _new_entry()
+    entry["calls"] += calls
+    entry["wall_seconds"] += wall_seconds
+    entry["cpu_seconds"] += cpu_seconds
+    entry["rows"] += rows or 0
+    entry["db_statements"] += db_statements
+    return entry
+
+
+class Span:
+    """Context manager returned by measure."""
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self._statements = _statements
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        global _peak_rss
+        wall_seconds = time.perf_counter() - self._wall
+        entry = record(
+            self.name,
+            wall_seconds=wall_seconds,
+            cpu_seconds=time.process_time() - self._cpu,
+            rows=self.rows,
+            db_statements=_statements - self._statements,
+        )
+        # Reading the RSS costs as much as the rest, so short calls of hot
+        # functions reuse the last reading
+        if wall_seconds >= RSS_SAMPLE_SECONDS or not _peak_rss:
+            _peak_rss = peak_rss_bytes()
+        entry["peak_rss_bytes"] = max(entry["peak_rss_bytes"], _peak_rss)
+
+
+def measure(name, rows=None) -> Span:
+    """Time a block and count the DB statements it executes."""
+    return Span(name, rows)
+
+
+def timed(name, rows=None):
+    """Decorator that measures every call of a function under ``name``."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(name) as span:
+                result = func(*args, **kwargs)
+                if rows is not None:
+                    span.rows = rows(result)
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    global _statements
+    _statements += 1
+
+
+def instrument_engine(engine):
+    """Count the statements an engine executes, executemany counting once."""
+    from sqlalchemy import event
+
+    if not event.contains(engine, "before_cursor_execute", _count_statement):
+        event.listen(engine, "before_cursor_execute", _count_statement)
+
+
+def snapshot() -> dict:
+    return {name: dict(entry) for name, entry in _metrics.items()}
+
+
+def merge(metrics: dict):
+    """Add the snapshot of another process, e.g. a pipeline stage worker."""
+    for name, other in metrics.items():
+        entry = record(
+            name,
+            calls=other["calls"],
+            wall_seconds=other["wall_seconds"],
+            cpu_seconds=other["cpu_seconds"],
+            rows=other["rows"],
+            db_statements=other["db_statements"],
+        )
+        entry["peak_rss_bytes"] = max(entry["peak_rss_bytes"], other["peak_rss_bytes"])
+
+
+def reset():
+    _metrics.clear()
+
+
+def _write_atomic(path, content):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def write_report(path, **run):
+    """Write the collected metrics and the given run details as JSON."""
+    report = {
+        **run,
+        "written_at": datetime.now().isoformat(),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "metrics": snapshot(),
+    }
+    _write_atomic(path, json.dumps(report, indent=2, default=str))
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def write_prometheus(path, prefix=PROMETHEUS_PREFIX):
+    """Write the collected metrics in the Prometheus textfile collector format."""
+    lines = []
+    for field in _new_entry():
+        metric = f"{prefix}_{field}"
+        lines.append(f"# TYPE {metric} gauge")
+        for name, entry in sorted(_metrics.items()):
+            lines.append(f'{metric}{{name="{_label(name)}"}} {entry[field]}')
+    lines.append(f"# TYPE {prefix}_run_peak_rss_bytes gauge")
+    lines.append(f"{prefix}_run_peak_rss_bytes {peak_rss_bytes()}")
+    lines.append(f"# TYPE {prefix}_run_timestamp_seconds gauge")
+    lines.append(f"{prefix}_run_timestamp_seconds {time.time()}")
+    _write_atomic(path, "\n".join(lines) + "\n")
@@ -0,0 +1,147 @@
+from collections import defaultdict
+import numpy as np
+from util.structural_diff import blueprint_features, normalize_blueprint
+from util.text_manipulation import parse_yaml_cached
+
+MINHASH_NUM_PERM = 128
+MINHASH_SEED = 1
+# Bands of the LSH index. 32 bands of 4 rows catch pairs with a Jaccard
+# similarity of about 0.5 and above with high probability.
+LSH_BANDS = 32
+
+# Mersenne prime 2^31 - 1. Feature indices are below 2^24, so a * x + b stays
+# within uint64.
+_PRIME = np.uint64((1 << 31) - 1)
+
+
+class MinHasher:
+    """Compute MinHash signatures of feature sets."""
+
+    def __init__(self, num_perm: int = MINHASH_NUM_PERM, seed: int = MINHASH_SEED):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)
+
+    def signature(self, features) -> np.ndarray:
+        x = np.fromiter(features, dtype=np.uint64)
+        if len(x) == 0:
+            return np.full(self.num_perm, _PRIME, dtype=np.uint32)
+        hashes = (np.outer(x, self.a) + self.b) % _PRIME
+        return hashes.min(axis=0).astype(np.uint32)
+
+    def signature_from_code(self, blueprint_code) -> np.ndarray | None:
+        """Return the signature of a blueprint's normalized tree, or None."""
+        bp_dict = parse_yaml_cached(blueprint_code)
+        if bp_dict is None:
+            return None
+        normalized = normalize_blueprint(bp_dict)
+        return self.signature(blueprint_features(normalized).keys())
+
+
+def signature_to_bytes(signature: np.ndarray) -> bytes:
+    return signature.astype("<u4").tobytes()
+
+
+def signature_from_bytes(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype="<u4")
+
+
+def estimate_jaccard(signature1: np.ndarray, signature2: np.ndarray) -> float:
+    return float(np.mean(signature1 == signature2))
+
+
+class LSHIndex:
+    """Banded locality-sensitive hashing index over MinHash signatures."""
+
+    def __init__(self, num_perm: int = MINHASH_NUM_PERM, bands: int = LSH_BANDS):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.signatures = {}
+        self._buckets = defaultdict(set)
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def __contains__(self, key):
+        return key in self.signatures
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            start = band * self.rows
+            yield band, signature[start : start + self.rows].tobytes()
+
+    def add(self, key, signature: np.ndarray):
+        if key in self.signatures:
+            if np.array_equal(self.signatures[key], signature):
+                return
+            self.remove(key)
+        self.signatures[key] = signature
+        for band_key in self._band_keys(signature):
+            self._buckets[band_key].add(key)
+
+    def remove(self, key):
+        signature = self.signatures.pop(key)
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets[band_key]
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[band_key]
+
+    def candidates(self, signature: np.ndarray) -> set:
+        keys = set()
+        for band_key in self._band_keys(signature):
+            keys |= self._buckets.get(band_key, set())
+        return keys
+
+    def query(self, key_or_signature, threshold: float = 0.8):
+        """Return ``(key, similarity)`` of near duplicates, most similar first."""
+        if isinstance(key_or_signature, np.ndarray):
+            key, signature = None, key_or_signature
+        else:
+            key, signature = key_or_signature, self.signatures[key_or_signature]
+        matches = []
+        for candidate in self.candidates(signature):
+            if candidate == key:
+                continue
+            similarity = estimate_jaccard(signature, self.signatures[candidate])
+            if similarity >= threshold:
+                matches.append((candidate, similarity))
+        return sorted(matches, key=lambda match: match[1], reverse=True)
+
+    def clusters(self, threshold: float = 0.8) -> list[list]:
+        """Return groups of keys connected by pairs at or above ``threshold``."""
+        parent = {}
+
+        def find(key):
+            while parent.get(key, key) != key:
+                key = parent[key]
+            return key
+
+        checked = set()
+        for bucket in self._buckets.values():
+            if len(bucket) < 2:
+                continue
+            members = sorted(bucket)
+            for i, key1 in enumerate(members):
+                for key2 in members[i + 1 :]:
+                    if (key1, key2) in checked:
+                        continue
+                    checked.add((key1, key2))
+                    similarity = estimate_jaccard(
+                        self.signatures[key1], self.signatures[key2]
+                    )
+                    if similarity >= threshold:
+                        root1, root2 = find(key1), find(key2)
+                        if root1 != root2:
+                            parent[max(root1, root2)] = min(root1, root2)
+
+        groups = defaultdict(list)
+        for key in parent:
+            groups[find(key)].append(key)
+        for root, keys in groups.items():
+            if root not in keys:
+                keys.append(root)
+        return [sorted(keys) for keys in groups.values()]
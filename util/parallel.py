@@ -0,0 +1,24 @@
+import multiprocessing
+import os
+from tqdm import tqdm
+
+
+def parallel_map(func, items, workers=1, chunksize=None, desc=None, initializer=None):
+    """Apply ``func`` to every item in input order, optionally in a process pool."""
+    items = list(items)
+    workers = workers or os.cpu_count()
+    if workers == 1 or len(items) < 2:
+        if initializer is not None:
+            initializer()
+        return [func(item) for item in tqdm(items, desc=desc)]
+
+    if chunksize is None:
+        chunksize = max(1, len(items) // (workers * 4))
+    with multiprocessing.Pool(workers, initializer=initializer) as pool:
+        return list(
+            tqdm(
+                pool.imap(func, items, chunksize=chunksize),
+                total=len(items),
+                desc=f"{desc} ({workers} workers)" if desc else None,
+            )
+        )
@@ -0,0 +1,50 @@
+import os
+import signal
+from collections import Counter
+from contextlib import contextmanager
+from logging import info, warning
+
+# Seconds of CPU time between two samples unless SAMPLING_PROFILER_INTERVAL is set
+DEFAULT_INTERVAL = 0.005
+
+
+def _stack(frame) -> str:
+    names = []
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "?")
+        names.append(f"{module}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+@contextmanager
+def sampling_profiler(output=None, interval=None):
+    """Write folded stacks of this process to SAMPLING_PROFILER_OUTPUT if set."""
+    output = output or os.getenv("SAMPLING_PROFILER_OUTPUT")
+    if not output:
+        yield None
+        return
+    if not hasattr(signal, "setitimer"):
+        warning("The sampling profiler needs SIGPROF, which isn't available here")
+        yield None
+        return
+    interval = interval or float(
+        os.getenv("SAMPLING_PROFILER_INTERVAL", DEFAULT_INTERVAL)
+    )
+
+    samples = Counter()
+
+    def sample(signum, frame):
+        samples[_stack(frame)] += 1
+
+    previous = signal.signal(signal.SIGPROF, sample)
+    signal.setitimer(signal.ITIMER_PROF, interval, interval)
+    try:
+        yield samples
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, previous)
+        with open(output, "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        info(f"Wrote {sum(samples.values())} profiler samples to {output}")
@@ -0,0 +1,208 @@
+import json
+import os
+from datetime import datetime
+from logging import debug, info
+from pathlib import Path
+
+import pandas as pd
+from sqlalchemy import func, or_, select
+
+from db.database import Database
+from db.models import BlueprintFiltered, Post, Topic
+from util.cache import content_hash
+from util.dataframe_utils import (
+    DATAFRAME_CHUNK_SIZE,
+    filtered_topic_ids_query,
+    get_dataframes,
+    read_frame,
+)
+
+# Bump when the layout of the snapshot files changes
+SNAPSHOT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+# Frame name -> model and the column that changes whenever a row does
+SNAPSHOT_TABLES = {
+    "bp_df": (BlueprintFiltered, "updated_at"),
+    "posts_df": (Post, "updated_at"),
+    "topics_df": (Topic, "crawled_at"),
+}
+# Rows fetched by id per statement when refreshing
+REFRESH_ID_CHUNK_SIZE = 500
+
+
+def _topic_filter(model):
+    if model is BlueprintFiltered:
+        return None
+    return model.topic_id.in_(filtered_topic_ids_query())
+
+
+def _where(stmt, *conditions):
+    conditions = [condition for condition in conditions if condition is not None]
+    return stmt.where(*conditions) if conditions else stmt
+
+
+def _database_state(db: Database) -> tuple[dict, list[str]]:
+    """Row counts, latest change time and filtered topics of the snapshot tables."""
+    with db.engine.connect() as conn:
+        topic_ids = sorted(conn.execute(filtered_topic_ids_query()).scalars())
+        tables = {}
+        for name, (model, timestamp_column) in SNAPSHOT_TABLES.items():
+            timestamp = getattr(model, timestamp_column)
+            stmt = select(func.count(), func.max(timestamp)).select_from(model)
+            rows, max_timestamp = conn.execute(_where(stmt, _topic_filter(model))).one()
+            tables[name] = {
+                "rows": rows,
+                "max_timestamp": max_timestamp.isoformat() if max_timestamp else None,
+            }
+    return {
+        "version": SNAPSHOT_VERSION,
+        "database": db.database_name if db.local else db.postgresql_db_name,
+        "topic_ids": content_hash("\n".join(topic_ids)),
+        "tables": tables,
+    }, topic_ids
+
+
+def _read_manifest(snapshot_dir: Path) -> dict | None:
+    try:
+        return json.loads((snapshot_dir / MANIFEST_FILE).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomic(path: Path, write):
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _write_frame(snapshot_dir: Path, name, df: pd.DataFrame):
+    import pyarrow.feather as feather
+
+    # Uncompressed Feather files can be memory-mapped when loading
+    _write_atomic(
+        snapshot_dir / f"{name}.feather",
+        lambda path: feather.write_feather(df, path, compression="uncompressed"),
+    )
+
+
+def _read_frame(snapshot_dir: Path, name, columns=None) -> pd.DataFrame:
+    import pyarrow.feather as feather
+
+    if columns is not None:
+        columns = list(dict.fromkeys(["topic_id", *columns]))
+    table = feather.read_table(
+        snapshot_dir / f"{name}.feather", columns=columns, memory_map=True
+    )
+    return table.to_pandas()
+
+
+def _refresh_frame(db, snapshot_dir, name, since, topic_dtype, chunksize):
+    """Merge rows changed since the last snapshot into a snapshot frame."""
+    model, timestamp_column = SNAPSHOT_TABLES[name]
+    timestamp = getattr(model, timestamp_column)
+    columns = list(model.__table__.columns)
+    topic_filter = _topic_filter(model)
+
+    with db.engine.connect() as conn:
+        current_ids = set(
+            conn.execute(_where(select(model.id), topic_filter)).scalars()
+        )
+    changed_since = timestamp.is_(None)
+    if since is not None:
+        changed_since = or_(timestamp > datetime.fromisoformat(since), changed_since)
+    frames = [
+        read_frame(
+            db,
+            _where(select(*columns), topic_filter, changed_since),
+            topic_dtype,
+            chunksize,
+        )
+    ]
+
+    old = _read_frame(snapshot_dir, name)
+    new_ids = sorted(current_ids - set(old["id"]) - set(frames[0]["id"]))
+    for start in range(0, len(new_ids), REFRESH_ID_CHUNK_SIZE):
+        chunk = new_ids[start : start + REFRESH_ID_CHUNK_SIZE]
+        frames.append(
+            read_frame(
+                db, select(*columns).where(model.id.in_(chunk)), topic_dtype, chunksize
+            )
+        )
+
+    changed_ids = set().union(*(frame["id"] for frame in frames))
+    kept = old[old["id"].isin(current_ids) & ~old["id"].isin(changed_ids)].copy()
+    kept["topic_id"] = kept["topic_id"].astype(object).astype(topic_dtype)
+    merged = pd.concat([kept, *frames], ignore_index=True)
+    merged = merged.sort_values("id", ignore_index=True)
+    if "tags" in merged.columns:
+        merged["tags"] = merged["tags"].astype(object).astype("category")
+    if len(merged) != len(current_ids):
+        return None
+    debug(f"Refreshed {name}: {len(changed_ids)} rows changed")
+    return merged
+
+
+def _refresh_frames(db, snapshot_dir, manifest, state, topic_ids, chunksize):
+    """Return the refreshed frames that changed, or None if any can't be merged."""
+    topic_dtype = pd.CategoricalDtype(topic_ids)
+    topics_changed = manifest["topic_ids"] != state["topic_ids"]
+    frames = {}
+    for name in SNAPSHOT_TABLES:
+        if not topics_changed and manifest["tables"][name] == state["tables"][name]:
+            continue
+        since = manifest["tables"][name]["max_timestamp"]
+        df = _refresh_frame(db, snapshot_dir, name, since, topic_dtype, chunksize)
+        if df is None:
+            return None
+        frames[name] = df
+    info(f"Refreshed {', '.join(frames)} in the dataframe snapshot")
+    return frames
+
+
+def load_dataframes(
+    db: Database,
+    snapshot_dir=None,
+    bp_columns=None,
+    post_columns=None,
+    topic_columns=None,
+    chunksize=DATAFRAME_CHUNK_SIZE,
+):
+    """Return ``(bp_df, posts_df, topics_df)`` like get_dataframes, from a snapshot."""
+    snapshot_dir = snapshot_dir or os.getenv("SNAPSHOT_DIR")
+    columns = {
+        "bp_df": bp_columns,
+        "posts_df": post_columns,
+        "topics_df": topic_columns,
+    }
+    if not snapshot_dir:
+        return get_dataframes(db, bp_columns, post_columns, topic_columns, chunksize)
+
+    snapshot_dir = Path(snapshot_dir)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    manifest = _read_manifest(snapshot_dir)
+    state, topic_ids = _database_state(db)
+
+    frames = None
+    if manifest is None or any(
+        manifest.get(key) != state[key] for key in ("version", "database")
+    ):
+        info(f"Writing dataframe snapshot to {snapshot_dir}")
+    elif manifest != state:
+        frames = _refresh_frames(
+            db, snapshot_dir, manifest, state, topic_ids, chunksize
+        )
+        if frames is None:
+            info(f"Dataframe snapshot in {snapshot_dir} is inconsistent, rewriting it")
+    else:
+        debug(f"Dataframe snapshot in {snapshot_dir} is up to date")
+        frames = {}
+    if frames is None:
+        frames = dict(zip(SNAPSHOT_TABLES, get_dataframes(db, chunksize=chunksize)))
+    for name, df in frames.items():
+        _write_frame(snapshot_dir, name, df)
+
+    _write_atomic(
+        snapshot_dir / MANIFEST_FILE,
+        lambda path: path.write_text(json.dumps(state, indent=2)),
+    )
+    return tuple(_read_frame(snapshot_dir, name, columns[name]) for name in columns)
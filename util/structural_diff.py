@@ -1,9 +1,15 @@
+import hashlib
+import numpy as np
+from scipy.sparse import csr_matrix
 from db.models import Blueprint
 from util.text_manipulation import normalize_text
-from util.text_manipulation import parse_yaml
+from util.text_manipulation import parse_yaml_cached
 from db.database import Database
 from deepdiff import DeepDiff
 
+# Size of the hashed feature space, collisions are negligible at this size
+N_FEATURES = 2**24
+
 
 def normalize_blueprint(obj):
     if isinstance(obj, dict):
@@ -16,14 +22,14 @@ def normalize_blueprint(obj):
 
 def load_and_normalize_blueprints(topic_id=None, bps=None):
     if bps:
-        return [normalize_blueprint(parse_yaml(bp.blueprint_code)) for bp in bps]
+        return [normalize_blueprint(parse_yaml_cached(bp.blueprint_code)) for bp in bps]
     db = Database()
 
     topic_posts = db.get_posts_by_topic_id(topic_id)
     topic_bps = [db.get_blueprints_by_post_id(post.post_id) for post in topic_posts]
     topic_bps = [bp for sublist in topic_bps for bp in sublist]
     normalized_codes = [
-        normalize_blueprint(parse_yaml(bp.blueprint_code)) for bp in topic_bps
+        normalize_blueprint(parse_yaml_cached(bp.blueprint_code)) for bp in topic_bps
     ]
     return normalized_codes
 
@@ -35,22 +41,107 @@ def structural_diff(code1, code2):
     return diff, 1 - diff_size / total_size
 
 
+def flatten_blueprint(obj, path=""):
+    """Yield one ``path=value`` string per leaf of a normalized blueprint."""
+    if isinstance(obj, dict):
+        if not obj:
+            yield f"{path}={{}}"
+        for key, value in obj.items():
+            yield from flatten_blueprint(value, f"{path}/{key}")
+    elif isinstance(obj, list):
+        if not obj:
+            yield f"{path}=[]"
+        for value in obj:
+            yield from flatten_blueprint(value, f"{path}[]")
+    else:
+        yield f"{path}={obj}"
+
+
+def _feature_hash(feature: str) -> int:
+    digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % N_FEATURES
+
+
+def blueprint_features(normalized_code) -> dict[int, int]:
+    """Return hashed path/value features of a normalized blueprint with counts."""
+    features = {}
+    for feature in flatten_blueprint(normalized_code):
+        index = _feature_hash(feature)
+        features[index] = features.get(index, 0) + 1
+    return features
+
+
+def feature_matrix(normalized_codes) -> csr_matrix:
+    """Stack the features of several normalized blueprints into a CSR matrix."""
+    indptr = [0]
+    indices = []
+    data = []
+    for code in normalized_codes:
+        features = blueprint_features(code)
+        indices.extend(features.keys())
+        data.extend(features.values())
+        indptr.append(len(indices))
+    return csr_matrix(
+        (np.asarray(data, dtype=np.float64), indices, indptr),
+        shape=(len(normalized_codes), N_FEATURES),
+    )
+
+
+def similarity_matrix(normalized_codes, method="jaccard") -> np.ndarray:
+    """Return pairwise similarities of normalized blueprints."""
+    matrix = feature_matrix(normalized_codes)
+    if method == "jaccard":
+        matrix.data[:] = 1.0
+        intersection = (matrix @ matrix.T).toarray()
+        sizes = np.diff(matrix.indptr)
+        union = sizes[:, None] + sizes[None, :] - intersection
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(union > 0, intersection / union, 1.0)
+    if method == "cosine":
+        norms = np.sqrt(matrix.multiply(matrix).sum(axis=1)).A1
+        norms[norms == 0] = 1.0
+        dot = (matrix @ matrix.T).toarray()
+        return dot / norms[:, None] / norms[None, :]
+    raise ValueError(f"Invalid similarity method: {method}")
+
+
+def similar_pairs(normalized_codes, threshold, method="jaccard"):
+    """Return ``(i, j, similarity)`` for all pairs i < j above ``threshold``."""
+    similarity = similarity_matrix(normalized_codes, method)
+    i, j = np.nonzero(np.triu(similarity >= threshold, k=1))
+    return [(a, b, float(similarity[a, b])) for a, b in zip(i.tolist(), j.tolist())]
+
+
 def compare_multiple_bps(
     bps: list[Blueprint],
-) -> list[tuple[Blueprint, Blueprint, float]]:
+    threshold: float | None = None,
+    method: str = "jaccard",
+    explain: bool = False,
+) -> list[tuple]:
     """
-    Compare multiple blueprints and return their pairwise structural differences.
+    Compare multiple blueprints and return their pairwise structural similarity.
 
     :param bps: List of Blueprint objects to compare.
     :type bps: list[Blueprint]
-    :return: List of tuples containing pairs of Blueprints and their similarity score.
-    :rtype: list[tuple[Blueprint, Blueprint, float]]
+    :param threshold: Only return pairs with at least this similarity.
+    :type threshold: float | None
+    :param method: ``jaccard`` or ``cosine``.
+    :type method: str
+    :param explain: Append the DeepDiff of each returned pair.
+    :type explain: bool
+    :return: List of tuples containing pairs of Blueprints and their similarity
+        score, followed by their DeepDiff if ``explain`` is set.
+    :rtype: list[tuple]
     """
 
     normalized_codes = load_and_normalize_blueprints(bps=bps)
+    if threshold is None:
+        threshold = -np.inf
     comparison = []
-    for i in range(len(normalized_codes)):
-        for j in range(i + 1, len(normalized_codes)):
-            _, similarity = structural_diff(normalized_codes[i], normalized_codes[j])
+    for i, j, similarity in similar_pairs(normalized_codes, threshold, method):
+        if explain:
+            diff, _ = structural_diff(normalized_codes[i], normalized_codes[j])
+            comparison.append((bps[i], bps[j], similarity, diff))
+        else:
             comparison.append((bps[i], bps[j], similarity))
     return comparison
@@ -1,13 +1,17 @@
+import os
 import re
+from functools import lru_cache
 import yaml
 import logging
-from bs4 import BeautifulSoup
-import nltk
-from nltk.stem import WordNetLemmatizer
-from nltk.corpus import stopwords
+import html
+import html.entities
+from html.parser import HTMLParser
 import json
+from .cache import ContentCache, content_hash
+from .metrics import timed
 
-nltk.download("wordnet")
+# NLTK data used by TfidfPreprocessor, looked up without downloading
+NLTK_RESOURCES = {"wordnet": "corpora/wordnet", "stopwords": "corpora/stopwords"}
 
 
 def input_constructor(loader, node):
@@ -16,20 +20,48 @@ def input_constructor(loader, node):
     return {"!input": value}
 
 
+# Use libyaml's C loader when PyYAML was built with it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 # Register the custom constructor with the SafeLoader
 yaml.SafeLoader.add_constructor("!input", input_constructor)
+if YamlLoader is not yaml.SafeLoader:
+    YamlLoader.add_constructor("!input", input_constructor)
+
+# Bump when the parsed representation changes, e.g. a new custom constructor
+YAML_CACHE_VERSION = 1
+
+_yaml_cache = ContentCache(
+    maxsize=int(os.getenv("YAML_CACHE_SIZE", "2048")),
+    cache_dir=os.getenv("YAML_CACHE_DIR"),
+)
 
 
 def parse_yaml(text) -> dict | None:
     try:
         # Attempt to load the text as YAML
-        return yaml.load(text, Loader=yaml.SafeLoader)
+        return yaml.load(text, Loader=YamlLoader)
     except yaml.YAMLError as e:
         # Log the error
         logging.debug("Invalid YAML: " + str(e))
         return None
 
 
+def parse_yaml_cached(text) -> dict | None:
+    """Parse YAML once per distinct text and return a copy of the cached tree."""
+    key = f"yaml{YAML_CACHE_VERSION}-{content_hash(text)}"
+    return _yaml_cache.get_or_compute(key, parse_yaml, text)
+
+
+def configure_yaml_cache(maxsize: int | None = None, cache_dir=None):
+    """Replace the parsed YAML cache, e.g. to enable on-disk persistence."""
+    global _yaml_cache
+    _yaml_cache = ContentCache(
+        maxsize=maxsize if maxsize is not None else _yaml_cache.maxsize,
+        cache_dir=cache_dir,
+    )
+
+
 def normalize_text(domain: str):
     return domain.lower().replace("-", "_").replace("/", "_").replace(" ", "_")
 
@@ -46,52 +78,221 @@ def get_leaf_values(data):
         yield data
 
 
-def remove_html(text):
-    soup = BeautifulSoup(text, "html.parser")
+class _HtmlTextExtractor(HTMLParser):
+    """Collects the text of an HTML fragment, skipping links and YAML code blocks."""
+
+    SKIPPED_CODE_CLASSES = frozenset({"lang-auto", "lang-yaml"})
+    # Text in these tags is not returned by BeautifulSoup's get_text()
+    SKIPPED_TAGS = frozenset({"script", "style", "template"})
+    VOID_TAGS = frozenset(
+        {
+            "area",
+            "base",
+            "br",
+            "col",
+            "embed",
+            "hr",
+            "img",
+            "input",
+            "link",
+            "meta",
+            "param",
+            "source",
+            "track",
+            "wbr",
+        }
+    )
+
+    def __init__(self):
+        # References are resolved by the handlers below the way BeautifulSoup
+        # does, e.g. an unknown "&foo;" becomes "&foo".
+        super().__init__(convert_charrefs=False)
+        self.parts = []
+        # (tag, skipped) for every open element
+        self._open_tags = []
+        self._skip_depth = 0
+
+    def _is_skipped(self, tag, attrs):
+        if tag == "a" or tag in self.SKIPPED_TAGS:
+            return True
+        if tag == "code":
+            for name, value in attrs:
+                if name == "class" and value:
+                    if self.SKIPPED_CODE_CLASSES.intersection(value.split()):
+                        return True
+        return False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.VOID_TAGS:
+            return
+        skipped = self._is_skipped(tag, attrs)
+        self._open_tags.append((tag, skipped))
+        self._skip_depth += skipped
 
-    for code_tag in soup.find_all("code", {"class": ["lang-auto", "lang-yaml"]}):
-        code_tag.decompose()
+    def handle_endtag(self, tag):
+        # Like BeautifulSoup, close everything up to the matching open tag and
+        # ignore end tags that were never opened.
+        for i in range(len(self._open_tags) - 1, -1, -1):
+            if self._open_tags[i][0] == tag:
+                for _, skipped in self._open_tags[i:]:
+                    self._skip_depth -= skipped
+                del self._open_tags[i:]
+                return
 
-    for a_tag in soup.find_all("a"):
-        a_tag.decompose()
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
 
-    return soup.get_text().replace("\n", " ").strip()
+    def handle_charref(self, name):
+        self.handle_data(html.unescape(f"&#{name};"))
 
+    def handle_entityref(self, name):
+        self.handle_data(html.entities.html5.get(f"{name};", f"&{name}"))
 
-def preprocess(text):
-    text = remove_html(text)
+    def unknown_decl(self, data):
+        if data.upper().startswith("CDATA["):
+            self.handle_data(data[len("CDATA[") :])
+
+    def get_text(self):
+        return "".join(self.parts)
+
+
+def _remove_html(text):
+    parser = _HtmlTextExtractor()
+    parser.feed(text)
+    parser.close()
+    return parser.get_text().replace("\n", " ").strip()
+
+
+# Cleaned post text keyed on (post_id, updated_at), so unchanged posts are
+# not parsed again. Set HTML_CACHE_DIR to persist it across runs.
+# Bump when the output of _remove_html changes
+HTML_CACHE_VERSION = 1
+_html_cache = ContentCache(
+    maxsize=int(os.getenv("HTML_CACHE_SIZE", "8192")),
+    cache_dir=os.getenv("HTML_CACHE_DIR"),
+)
+
+
+@timed("text.remove_html")
+def remove_html(text, cache_key=None):
+    """Return the text of an HTML fragment without links and YAML code blocks."""
+    if cache_key is None:
+        return _remove_html(text)
+    key = f"html{HTML_CACHE_VERSION}-{content_hash(repr(cache_key))}"
+    return _html_cache.get_or_compute(key, _remove_html, text)
+
+
+def preprocess(text, cache_key=None):
+    text = remove_html(text, cache_key)
     text = text.lower()
     text = re.sub(r"’", r"'", text)
     text = re.sub(r"‘", r"'", text)
     return text
 
 
+def require_nltk_resources():
+    """Raise LookupError naming the missing NLTK data and how to install it."""
+    import nltk
+
+    missing = []
+    for name, resource in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            missing.append(name)
+    if missing:
+        raise LookupError(
+            f"Missing NLTK data: {', '.join(missing)}. Install it with "
+            f"`python -m nltk.downloader {' '.join(missing)}` "
+            "or point NLTK_DATA to a directory that contains it."
+        )
+
+
+# Words that are dropped from every TF-IDF document in addition to stopwords
+TFIDF_IGNORABLE_WORDS = ("blueprint", "automation", "entity", "work")
+
+
+class TfidfPreprocessor:
+    """Reusable text normalizer for TF-IDF corpora."""
+
+    _APOSTROPHE = re.compile(r"’")
+    _NON_WORD = re.compile(r"[^\w'\s]")
+    _NUMBER = re.compile(r"\b\d+\b")
+
+    def __init__(self, lemma_cache_size: int = 65536, pattern_cache_size: int = 4096):
+        require_nltk_resources()
+        from nltk.corpus import stopwords
+        from nltk.stem import WordNetLemmatizer
+
+        self.stopwords = frozenset(stopwords.words("english"))
+        self.lemmatizer = WordNetLemmatizer()
+        self.lemmatize = lru_cache(maxsize=lemma_cache_size)(self.lemmatizer.lemmatize)
+        self._ignorable_pattern = lru_cache(maxsize=pattern_cache_size)(
+            self._compile_ignorable_pattern
+        )
+
+    def _compile_ignorable_pattern(self, ignorable_words: tuple) -> re.Pattern | None:
+        ignorable_words = [self.lemmatize(w.lower()) for w in ignorable_words]
+        safe_tokens = [re.escape(w) for w in ignorable_words if w]
+        if not safe_tokens:
+            return None
+        return re.compile("|".join(safe_tokens), flags=re.IGNORECASE)
+
+    def ignorable_pattern(self, ignorable_words: list[str] | str | None = None):
+        # Missing tags are None, or NaN when read into a categorical column
+        if ignorable_words is None or ignorable_words != ignorable_words:
+            ignorable_words = []
+        elif not isinstance(ignorable_words, list):
+            ignorable_words = [ignorable_words]
+        return self._ignorable_pattern(tuple(ignorable_words) + TFIDF_IGNORABLE_WORDS)
+
+    def _preprocess(self, text, pattern: re.Pattern | None, cache_key=None) -> str:
+        text = remove_html(text, cache_key)
+        text = text.lower()
+        text = self._APOSTROPHE.sub("'", text)
+        text = self._NON_WORD.sub("", text)
+        text = self._NUMBER.sub("", text)
+        text = " ".join(
+            self.lemmatize(word) for word in text.split() if word not in self.stopwords
+        )
+        if pattern is not None:
+            text = pattern.sub("", text)
+        return text
+
+    def __call__(
+        self, text, ignorable_words: list[str] | str | None = None, cache_key=None
+    ) -> str:
+        return self._preprocess(
+            text, self.ignorable_pattern(ignorable_words), cache_key
+        )
+
+    def transform(
+        self, texts, ignorable_words: list[str] | str | None = None, cache_keys=None
+    ) -> list[str]:
+        """Preprocess several texts that share the same ignorable words."""
+        pattern = self.ignorable_pattern(ignorable_words)
+        if cache_keys is None:
+            cache_keys = [None] * len(texts)
+        return [
+            self._preprocess(text, pattern, cache_key)
+            for text, cache_key in zip(texts, cache_keys)
+        ]
+
+
+_tfidf_preprocessor = None
+
+
+def get_tfidf_preprocessor() -> TfidfPreprocessor:
+    """Return the shared TfidfPreprocessor, creating it on first use."""
+    global _tfidf_preprocessor
+    if _tfidf_preprocessor is None:
+        _tfidf_preprocessor = TfidfPreprocessor()
+    return _tfidf_preprocessor
+
+
 def tfidf_preprocessing(text, ignorable_words: list[str] | str | None = None):
-    if ignorable_words is None:
-        ignorable_words = []
-    elif not isinstance(ignorable_words, list):
-        ignorable_words = [ignorable_words]
-    ignorable_words = ignorable_words + ["blueprint", "automation", "entity", "work"]
-    text = remove_html(text)
-    lemmatizer = WordNetLemmatizer()
-    ignorable_words = [lemmatizer.lemmatize(w.lower()) for w in ignorable_words]
-    text = text.lower()
-    text = re.sub(r"’", r"'", text)
-    text = re.sub(r"[^\w'\s]", "", text)
-    text = re.sub(r"\b\d+\b", "", text)
-    text = text.split()
-    text = [
-        lemmatizer.lemmatize(word)
-        for word in text
-        if word not in stopwords.words("english")
-    ]
-    text = " ".join(text)
-    # text = re.sub("|".join(ignorable_words), "", text, flags=re.IGNORECASE)
-    safe_tokens = [re.escape(w) for w in ignorable_words if w]
-    if safe_tokens:
-        pattern = "|".join(safe_tokens)
-        text = re.sub(pattern, "", text, flags=re.IGNORECASE)
-    return text
+    return get_tfidf_preprocessor()(text, ignorable_words)
 
 
 def keywords_remove_input(kwd_dict: dict[str, int] | str) -> list[str] | None: